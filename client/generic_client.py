@@ -1,13 +1,169 @@
-import http.server
+import asyncio
+import concurrent.futures
+import json
 import requests
+import secrets
 import sys
+import threading
 import time
 from urllib.parse import urlencode, parse_qs, urlparse
 
+import httpx
+from requests.adapters import HTTPAdapter
+
+from stream_extract import astream_items, pick, stream_items
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # generic client for interacting with the API using the OAuth flow
 
+PROXY_URL = 'http://localhost:8000'
+# the OAuth callback listener binds here, port 0 picks a free one so several
+# agent processes can authorize on one machine
+CALLBACK_HOST = '127.0.0.1'
+CALLBACK_PORT = 0
+# seconds to wait for the browser to come back with a code
+AUTHORIZE_TIMEOUT = 300
+POOL_SIZE = 20
+# bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+# treat cached tokens as expired this many seconds early so a new one is
+# fetched before the proxy starts rejecting the old one
+TOKEN_REFRESH_MARGIN = 60
+# decoder for proxied response bodies, 'orjson' when installed or 'stdlib'
+JSON_CODEC = 'orjson'
+
+
+def decode_json(data):
+    """Decode a JSON body, with orjson when it is available and enabled"""
+    if orjson is not None and JSON_CODEC == 'orjson':
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the stdlib (lone surrogates, for one), let the stdlib decide
+            pass
+    return json.loads(data)
+
+
+class CallbackListener:
+    """Long-lived OAuth redirect receiver shared by every flow in the process.
+
+    An asyncio server runs on a daemon thread; each authorization registers
+    its state and gets a future that the callback resolves with the code,
+    so any number of flows can wait at once on one socket.
+    """
+
+    def __init__(self, host=CALLBACK_HOST, port=CALLBACK_PORT):
+        self.host = host
+        self.waiters = {}
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        started = concurrent.futures.Future()
+        self.thread = threading.Thread(
+            target=self._run, args=(port, started), daemon=True)
+        self.thread.start()
+        self.port = started.result()
+
+    @property
+    def redirect_uri(self):
+        return f'http://{self.host}:{self.port}/callback'
+
+    def _run(self, port, started):
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, port))
+        except OSError as e:
+            started.set_exception(e)
+            return
+        started.set_result(server.sockets[0].getsockname()[1])
+        self.loop.run_forever()
+
+    def expect(self, state):
+        """Register a flow, the returned future resolves with its code"""
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.waiters[state] = future
+        return future
+
+    def discard(self, state):
+        with self.lock:
+            self.waiters.pop(state, None)
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # the headers are not needed, read up to the blank line that ends them
+            while await asyncio.wait_for(reader.readline(), 10) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            query = parse_qs(urlparse(parts[1]).query) if len(parts) > 1 else {}
+
+            with self.lock:
+                future = self.waiters.pop(query.get('state', [None])[0], None)
+            status, message = '400 Bad Request', 'Unknown or expired authorization request'
+            if future is not None:
+                try:
+                    future.set_result(query.get('code', [None])[0])
+                    status, message = '200 OK', 'Got code, you can close this window'
+                except concurrent.futures.InvalidStateError:
+                    # the flow was cancelled on its own thread before it discarded its state
+                    pass
+
+            body = message.encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: text/html\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def callback_listener():
+    """The process-wide callback listener, started on first use"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = CallbackListener()
+        return _listener
+
+
+def projection_params(select=None, fields=None):
+    """Query parameters asking the proxy to trim its response, fields as in stream_extract.pick"""
+    params = {}
+    if select:
+        params['select'] = select
+    if fields:
+        if isinstance(fields, dict):
+            fields = ','.join(
+                f"{name}={paths if isinstance(paths, str) else '|'.join(paths)}"
+                for name, paths in fields.items())
+        params['fields'] = fields
+    return params
+
+
+def decode_body(response):
+    """Decoded JSON for JSON responses, the text of anything else"""
+    if response.headers.get('content-type', '').startswith('application/json'):
+        return decode_json(response.content)
+    return response.text
+
+
+class BaseClient:
+    """Token cache and authorize flow shared by GenericClient and AsyncGenericClient"""
+
+    # one scope prompt on the terminal at a time, flows still wait concurrently
+    _prompt_lock = threading.Lock()
 
-class GenericClient:
     def __init__(self, client_id: str, client_secret: str):
         self.tokens = {}
         self.client_id = client_id
@@ -39,41 +195,33 @@ class GenericClient:
                 return False
             self._print_error("Please answer 'yes' or 'no'")
 
-    def get_token(self, host, scopes=None):
-        """Get OAuth token for a specific host with optional scopes"""
-        code = None
-
-        def handler(req):
-            nonlocal code
-            query = parse_qs(urlparse(req.path).query)
-            code = query.get('code', [None])[0]
-            req.send_response(200)
-            req.send_header('Content-Type', 'text/html')
-            req.end_headers()
-            req.wfile.write(b"Got code, you can close this window")
-
+    def _start_authorize(self, host, scopes=None):
+        """Confirm scopes and show the authorize URL, returns (state, waiter) or None"""
         # First confirm scopes with user
-        if not self._confirm_scopes(scopes):
+        with self._prompt_lock:
+            confirmed = self._confirm_scopes(scopes)
+        if not confirmed:
             self._print_info("Authorization cancelled by user")
             return None
 
-        # Start local server to receive the OAuth callback
-        server = http.server.HTTPServer(('', 8080), lambda *args:
-                                        type('Handler', (http.server.BaseHTTPRequestHandler,), {'do_GET': lambda self: handler(self)})(*args))
+        # the callback is routed back to this flow by its state
+        listener = callback_listener()
+        state = secrets.token_urlsafe(16)
+        waiter = listener.expect(state)
 
         formatted_host = host.replace('.', '_').replace(':', '_')
 
         # Include scopes in authorization request
         auth_params = {
             'client_id': self.client_id,
-            'redirect_uri': 'http://localhost:8080',
-            'host': formatted_host
+            'redirect_uri': listener.redirect_uri,
+            'host': formatted_host,
+            'state': state
         }
         if scopes:
             auth_params['scope'] = ' '.join(scopes)
 
-        auth_url = 'http://localhost:8000/oauth/authorize?' + \
-            urlencode(auth_params)
+        auth_url = f'{PROXY_URL}/oauth/authorize?' + urlencode(auth_params)
 
         # Instead of opening browser, show URL and instructions
         self._print_info(
@@ -81,45 +229,248 @@ class GenericClient:
         self._print_info(f"\n{auth_url}\n")
         self._print_info(
             "Waiting for authorization... (Press Ctrl+C to cancel)")
+        return state, waiter
 
-        try:
-            server.handle_request()
-        except KeyboardInterrupt:
-            self._print_info("\nAuthorization cancelled by user")
-            return None
-
+    def _finish_authorize(self, code):
         if not code:
             self._print_error("Failed to get authorization code")
             return None
 
         self._print_info(
             "Authorization code received, requesting access token...")
+        return code
 
-        # Exchange code for token
-        token_url = 'http://localhost:8000/oauth/token?' + urlencode({
+    def _token_url(self, code):
+        return f'{PROXY_URL}/oauth/token?' + urlencode({
             'code': code,
             'client_id': self.client_id,
-            'redirect_uri': 'http://localhost:8080'
+            'redirect_uri': callback_listener().redirect_uri
         })
 
-        r = requests.post(token_url)
+    @staticmethod
+    def _token_key(host):
+        return host.replace('.', '_').replace(':', '_')
+
+    @staticmethod
+    def _requested_scopes(scopes):
+        # the proxy grants "default" when no scope is asked for
+        return frozenset(scopes) if scopes else frozenset(['default'])
+
+    def _cached_token(self, host, scopes=None):
+        """Return a live cached token for host whose scopes cover the requested ones"""
+        requested = self._requested_scopes(scopes)
+        now = time.time()
+        entries = self.tokens.get(self._token_key(host), [])
+        entries[:] = [e for e in entries
+                      if e['expires_at'] - TOKEN_REFRESH_MARGIN > now]
+        for entry in entries:
+            if requested <= entry['scopes']:
+                return entry['access_token']
+        return None
+
+    def _store_token(self, host, scopes, token_response):
+        granted = token_response.get('scope', '').split()
+        self.tokens.setdefault(self._token_key(host), []).append({
+            'access_token': token_response['access_token'],
+            'scopes': frozenset(granted) or self._requested_scopes(scopes),
+            'expires_at': time.time() + token_response.get('expires_in', 3600)
+        })
+
+
+class GenericClient(BaseClient):
+    """Blocking client for the proxy, proxied calls share one requests session"""
+
+    def __init__(self, client_id: str, client_secret: str):
+        super().__init__(client_id, client_secret)
+
+        # keep connections to the proxy alive between calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _authorize(self, host, scopes=None):
+        """Run the interactive authorize step and return the authorization code"""
+        started = self._start_authorize(host, scopes)
+        if started is None:
+            return None
+        state, waiter = started
+
+        try:
+            code = waiter.result(timeout=AUTHORIZE_TIMEOUT)
+        except KeyboardInterrupt:
+            self._print_info("\nAuthorization cancelled by user")
+            return None
+        except concurrent.futures.TimeoutError:
+            code = None
+        finally:
+            callback_listener().discard(state)
+        return self._finish_authorize(code)
+
+    def get_token(self, host, scopes=None):
+        """Get OAuth token for a specific host with optional scopes"""
+        cached = self._cached_token(host, scopes)
+        if cached:
+            return cached
+
+        code = self._authorize(host, scopes)
+        if not code:
+            return None
+
+        # Exchange code for token
+        r = self.session.post(self._token_url(code))
         if r.status_code != 200:
             self._print_error(f"Failed to get token: {r.text}")
             return None
 
         self._print_info("Access token received successfully")
-        return r.json()['access_token']
+        token_response = r.json()
+        self._store_token(host, scopes, token_response)
+        return token_response['access_token']
+
+    def make_request(self, url, method="GET", token=None, body=None, select=None, fields=None):
+        """Make a proxied request using the token, projected by the proxy when select or fields is given"""
+        response = self.session.post(
+            f'{PROXY_URL}/api/proxy',
+            params={
+                'url': url,
+                'method': method,
+                **projection_params(select, fields)
+            },
+            headers={'Authorization': f'Bearer {token}',
+                     'Content-Type': 'application/json'},
+            json=body
+        )
 
-    def make_request(self, url, method="GET", token=None, body=None):
-        """Make a proxied request using the token"""
-        response = requests.post(
-            'http://localhost:8000/api/proxy',
+        if response.status_code != 200:
+            self._print_error(
+                f"Request failed with status {response.status_code}: {response.text}")
+            return response.text
+
+        return decode_body(response)
+
+    def stream_request(self, url, path, fields=None, method="GET", token=None, body=None):
+        """Make a proxied request and yield the values at path as the body arrives
+
+        The proxy streams the upstream bytes through unchanged and only the
+        values at path are decoded, trimmed to fields when given (see
+        stream_extract.pick). Stopping early closes the response.
+        """
+        response = self.session.post(
+            f'{PROXY_URL}/api/proxy',
             params={
                 'url': url,
-                'method': method
+                'method': method,
+                'stream': 'true'
             },
             headers={'Authorization': f'Bearer {token}',
                      'Content-Type': 'application/json'},
+            json=body,
+            stream=True
+        )
+
+        with response:
+            if response.status_code != 200:
+                self._print_error(
+                    f"Request failed with status {response.status_code}: {response.text}")
+                return
+
+            for item in stream_items(response.iter_content(STREAM_CHUNK_SIZE), path):
+                yield pick(item, fields) if fields else item
+
+    def make_batch_request(self, requests_list, token=None, concurrency=None):
+        """Make several proxied requests in one round trip, results come back in order"""
+        payload = {'requests': requests_list}
+        if concurrency:
+            payload['concurrency'] = concurrency
+
+        response = self.session.post(
+            f'{PROXY_URL}/api/proxy/batch',
+            headers={'Authorization': f'Bearer {token}',
+                     'Content-Type': 'application/json'},
+            json=payload
+        )
+
+        if response.status_code != 200:
+            self._print_error(
+                f"Batch request failed with status {response.status_code}: {response.text}")
+            return None
+
+        return decode_json(response.content)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncGenericClient(BaseClient):
+    """asyncio counterpart of GenericClient, proxied calls share one pooled connection set"""
+
+    def __init__(self, client_id: str, client_secret: str, max_connections: int = POOL_SIZE):
+        super().__init__(client_id, client_secret)
+        self.http = httpx.AsyncClient(
+            base_url=PROXY_URL,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(60.0)
+        )
+        self._pending = {}
+
+    async def get_token(self, host, scopes=None):
+        """Get OAuth token for a specific host with optional scopes"""
+        cached = self._cached_token(host, scopes)
+        if cached:
+            return cached
+
+        # concurrent callers for the same host and scopes share one flow
+        key = (self._token_key(host), self._requested_scopes(scopes))
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_token(host, scopes))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _authorize(self, host, scopes=None):
+        # the scope prompt blocks, keep it off the event loop; the wait for
+        # the callback does not hold a thread
+        started = await asyncio.to_thread(self._start_authorize, host, scopes)
+        if started is None:
+            return None
+        state, waiter = started
+
+        try:
+            code = await asyncio.wait_for(asyncio.wrap_future(waiter), AUTHORIZE_TIMEOUT)
+        except asyncio.TimeoutError:
+            code = None
+        finally:
+            callback_listener().discard(state)
+        return self._finish_authorize(code)
+
+    async def _fetch_token(self, host, scopes=None):
+        code = await self._authorize(host, scopes)
+        if not code:
+            return None
+
+        r = await self.http.post(self._token_url(code))
+        if r.status_code != 200:
+            self._print_error(f"Failed to get token: {r.text}")
+            return None
+
+        self._print_info("Access token received successfully")
+        token_response = r.json()
+        self._store_token(host, scopes, token_response)
+        return token_response['access_token']
+
+    async def make_request(self, url, method="GET", token=None, body=None, select=None, fields=None):
+        """Make a proxied request using the token, projected by the proxy when select or fields is given"""
+        response = await self.http.post(
+            '/api/proxy',
+            params={
+                'url': url,
+                'method': method,
+                **projection_params(select, fields)
+            },
+            headers={'Authorization': f'Bearer {token}'},
             json=body
         )
 
@@ -128,4 +479,54 @@ class GenericClient:
                 f"Request failed with status {response.status_code}: {response.text}")
             return response.text
 
-        return response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
+        return decode_body(response)
+
+    async def stream_request(self, url, path, fields=None, method="GET", token=None, body=None):
+        """Make a proxied request and yield the values at path as the body arrives"""
+        async with self.http.stream(
+            'POST',
+            '/api/proxy',
+            params={
+                'url': url,
+                'method': method,
+                'stream': 'true'
+            },
+            headers={'Authorization': f'Bearer {token}'},
+            json=body
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                self._print_error(
+                    f"Request failed with status {response.status_code}: {response.text}")
+                return
+
+            async for item in astream_items(response.aiter_bytes(STREAM_CHUNK_SIZE), path):
+                yield pick(item, fields) if fields else item
+
+    async def make_batch_request(self, requests_list, token=None, concurrency=None):
+        """Make several proxied requests in one round trip, results come back in order"""
+        payload = {'requests': requests_list}
+        if concurrency:
+            payload['concurrency'] = concurrency
+
+        response = await self.http.post(
+            '/api/proxy/batch',
+            headers={'Authorization': f'Bearer {token}'},
+            json=payload
+        )
+
+        if response.status_code != 200:
+            self._print_error(
+                f"Batch request failed with status {response.status_code}: {response.text}")
+            return None
+
+        return decode_json(response.content)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,235 @@
+import codecs
+import json
+import re
+from functools import lru_cache
+
+# path-based extraction from JSON documents, streamed or already decoded
+#
+#   paths are dotted keys with [*] for every element of an array:
+#     "data.user.result.timeline_v2.timeline.instructions[*].entries[*]"
+#     "result[*]"
+#
+#   fields name the parts of each extracted item a tool keeps, a tuple of
+#   paths is tried in order and the first one present wins, a number in a
+#   field path indexes an array:
+#     {"id": "id", "text": ("note.text", "legacy.full_text"), "first": "items.0.id"}
+#
+#   parse_path and _get are the same as in proxy/projection.py, so paths and
+#   fields can be sent to the proxy as select/fields unchanged
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_PATH_PART = re.compile(r'([^\[\]]*)((?:\[\*\])*)')
+_DECODER = json.JSONDecoder()
+_NUMBER_CONTINUES = frozenset('.eE+-0123456789')
+
+
+def parse_path(path):
+    """Split "a.b[*].c" into ['a', 'b', '*', 'c']"""
+    parts = []
+    for part in path.split('.') if path else ():
+        match = _PATH_PART.fullmatch(part)
+        if match is None or not (match.group(1) or match.group(2)):
+            raise ValueError(f"Unsupported path segment {part!r}, use key or key[*]")
+        name, stars = match.groups()
+        if name:
+            parts.append(name)
+        parts.extend('*' * (len(stars) // 3))
+    return parts
+
+
+def _get(obj, parts):
+    for part in parts:
+        if isinstance(obj, dict):
+            obj = obj.get(part)
+        elif isinstance(obj, list) and part.isdigit() and int(part) < len(obj):
+            obj = obj[int(part)]
+        else:
+            return None
+        if obj is None:
+            return None
+    return obj
+
+
+@lru_cache(maxsize=256)
+def _field_path(path):
+    parts = parse_path(path)
+    if '*' in parts:
+        raise ValueError(f"Field path {path!r} cannot contain [*]")
+    return tuple(parts)
+
+
+def pick(item, fields):
+    """Keep only the declared fields of an item, missing ones come back as None"""
+    picked = {}
+    for name, paths in fields.items():
+        if isinstance(paths, str):
+            paths = (paths,)
+        value = None
+        for path in paths:
+            value = _get(item, _field_path(path))
+            if value is not None:
+                break
+        picked[name] = value
+    return picked
+
+
+def select(obj, path):
+    """Yield the values at path in an already decoded document"""
+    parts = parse_path(path) if isinstance(path, str) else path
+    if not parts:
+        yield obj
+        return
+    head, rest = parts[0], parts[1:]
+    if head == '*':
+        children = obj if isinstance(obj, list) else obj.values() if isinstance(obj, dict) else ()
+    elif isinstance(obj, dict) and head in obj:
+        children = (obj[head],)
+    else:
+        children = ()
+    for child in children:
+        yield from select(child, rest)
+
+
+class StreamExtractor:
+    """Incremental JSON parser that returns the values at one path as their bytes arrive.
+
+    Feed it the response body chunk by chunk; every complete value at the
+    path is decoded and returned from feed() right away, containers along
+    the path are walked without being built, and everything else is decoded
+    only to be skipped. Memory is bounded by the largest array element on
+    the path, not by the document.
+    """
+
+    def __init__(self, path):
+        parts = parse_path(path)
+        # walking keys in Python is slower than decoding in C, so elements of
+        # the innermost [*] array are decoded whole and the rest of the path
+        # is applied to each of them in memory
+        split = len(parts) - parts[::-1].index('*') if '*' in parts else len(parts)
+        self.path, self.rest = parts[:split], parts[split:]
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        # one [kind, state, key] frame per open container on the path
+        self.stack = []
+        self.done = False
+        # a value that failed to decode is retried once the buffer has grown past this
+        self.retry_at = 0
+
+    def feed(self, data):
+        return self._consume(self.utf8.decode(data))
+
+    def close(self):
+        """Finish the document, raising ValueError if it was cut short"""
+        self.retry_at = 0
+        items = self._consume(self.utf8.decode(b'', final=True), final=True)
+        if not self.done:
+            raise ValueError("Truncated JSON document")
+        return items
+
+    def _consume(self, text, final=False):
+        self.retry_at -= self.pos
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        items = []
+        while not self.done and self._step(items, final):
+            pass
+        return items
+
+    def _decode(self, pos, final):
+        """Decode the value at pos, None when more data is needed"""
+        if len(self.buf) < self.retry_at and not final:
+            return None
+        try:
+            value, end = _DECODER.raw_decode(self.buf, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            # retried after the buffer doubles, so a large value costs linear time
+            self.retry_at = 2 * len(self.buf)
+            return None
+        if not final and self.buf[pos] not in '"{[' and \
+                (end == len(self.buf) or self.buf[end] in _NUMBER_CONTINUES):
+            # a number cut by the end of a chunk, "-2." decodes as -2 so far
+            return None
+        self.retry_at = 0
+        return value, end
+
+    def _end_value(self):
+        if self.stack:
+            self.stack[-1][1] = 'comma'
+        else:
+            self.done = True
+
+    def _step(self, items, final):
+        buf = self.buf
+        pos = _WHITESPACE.match(buf, self.pos).end()
+        self.pos = pos
+        if pos >= len(buf):
+            return False
+        ch = buf[pos]
+        frame = self.stack[-1] if self.stack else None
+
+        if frame is not None:
+            kind, state = frame[0], frame[1]
+            if state in ('key', 'value', 'comma') and ch in '}]':
+                self.stack.pop()
+                self.pos = pos + 1
+                self._end_value()
+                return True
+            if state == 'comma':
+                if ch != ',':
+                    raise ValueError(f"Expected ',' at {pos}, got {ch!r}")
+                frame[1] = 'key' if kind == '{' else 'value'
+                self.pos = pos + 1
+                return True
+            if state == 'key':
+                decoded = self._decode(pos, final)
+                if decoded is None:
+                    return False
+                frame[2], self.pos = decoded
+                frame[1] = 'colon'
+                return True
+            if state == 'colon':
+                if ch != ':':
+                    raise ValueError(f"Expected ':' at {pos}, got {ch!r}")
+                frame[1] = 'value'
+                self.pos = pos + 1
+                return True
+            key = frame[2] if kind == '{' else '*'
+        else:
+            key = None
+
+        depth = len(self.stack)
+        on_path = depth == 0 or self.path[depth - 1] in (key, '*')
+        if on_path and depth < len(self.path) and ch in '{[':
+            self.stack.append([ch, 'key' if ch == '{' else 'value', None])
+            self.pos = pos + 1
+            return True
+
+        decoded = self._decode(pos, final)
+        if decoded is None:
+            return False
+        value, self.pos = decoded
+        if on_path and depth == len(self.path):
+            items.extend(select(value, self.rest) if self.rest else (value,))
+        self._end_value()
+        return True
+
+
+def stream_items(chunks, path):
+    """Yield the values at path from an iterable of body chunks"""
+    extractor = StreamExtractor(path)
+    for chunk in chunks:
+        yield from extractor.feed(chunk)
+    yield from extractor.close()
+
+
+async def astream_items(chunks, path):
+    """Yield the values at path from an async iterable of body chunks"""
+    extractor = StreamExtractor(path)
+    async for chunk in chunks:
+        for item in extractor.feed(chunk):
+            yield item
+    for item in extractor.close():
+        yield item
@@ -5,53 +5,49 @@ import urllib.parse
 from langchain_core.tools import tool
 
 from generic_client import GenericClient
+from stream_extract import pick, select
 
 client = GenericClient(
     client_id='test-client',
     client_secret='test-secret'
 )
 
+# tweets in a UserTweets timeline, and the parts of each one the tools keep
+TWEET_PATH = "data.user.result.timeline_v2.timeline.instructions[*].entries[*].content.itemContent.tweet_results.result"
+TWEET_FIELDS = {
+    'rest_id': 'rest_id',
+    'screen_name': 'core.user_results.result.legacy.screen_name',
+    # long tweets carry their full text in note_tweet, the rest in legacy
+    'full_text': ('note_tweet.note_tweet_results.result.text', 'legacy.full_text')
+}
+
+PIAZZA_RESULT_PATH = "result[*]"
+PIAZZA_SEARCH_FIELDS = {
+    'subject': 'subject',
+    'content_snipet': 'content_snipet',
+    'id': 'id'
+}
+
+
+def collect_tweet_info(tweets):
+    """Build the user and the tweet texts from picked tweets, in timeline order"""
+    result = {
+        'user': {},
+        'tweets': []
+    }
+    for tweet in tweets:
+        if not result['user']:
+            result['user'] = {
+                'rest_id': tweet['rest_id'],
+                'screen_name': tweet['screen_name']
+            }
+        result['tweets'].append(tweet['full_text'])
+    return result
 
-def extract_tweet_info(response):
-    if 'data' in response and 'user' in response['data'] and 'result' in response['data']['user']:
-        user_result = response['data']['user']['result']
-        trigger = False
-
-        result = {
-            'user': {},
-            'tweets': []
-        }
-
-        if 'timeline_v2' in user_result and 'timeline' in user_result['timeline_v2']:
-            timeline = user_result['timeline_v2']['timeline']
-            if 'instructions' in timeline:
-                for instruction in timeline['instructions']:
-                    if instruction['type'] == 'TimelineAddEntries':
-                        for entry in instruction['entries']:
-                            if 'content' in entry and 'itemContent' in entry['content']:
-                                item_content = entry['content']['itemContent']
-                                if 'tweet_results' in item_content:
-                                    tweet_result = item_content['tweet_results']['result']
-                                    if trigger == False:
-                                        result['user']["rest_id"] = tweet_result.get(
-                                            'rest_id')
-                                    full_text = None
-                                    if 'note_tweet' in tweet_result and 'note_tweet_results' in tweet_result['note_tweet']:
-                                        full_text = tweet_result['note_tweet']['note_tweet_results']['result'].get(
-                                            'text')
-                                    elif 'legacy' in tweet_result:
-                                        full_text = tweet_result['legacy'].get(
-                                            'full_text')
-
-                                    if trigger == False:
-                                        screen_name = tweet_result['core']['user_results']['result']['legacy'].get(
-                                            'screen_name')
-                                        result['user']['screen_name'] = screen_name
-                                        trigger = True
-
-                                    result['tweets'].append(full_text)
 
-    return result
+def extract_tweet_info(response):
+    return collect_tweet_info(
+        pick(tweet, TWEET_FIELDS) for tweet in select(response, TWEET_PATH))
 
 
 @tool
@@ -77,9 +73,13 @@ def get_id_for_username(username: str):
     token = client.get_token(host='x.com', scopes=[
                              "profile", "tweet.read"])
 
-    response = client.make_request(url, method="GET", token=token)
-
-    return response['data']['user']['result']['rest_id']
+    # the proxy sends back just the id instead of the whole profile, error
+    # responses come back whole
+    rest_id = client.make_request(
+        url, method="GET", token=token, select="data.user.result.rest_id")
+    if not isinstance(rest_id, str) or not rest_id.isdigit():
+        raise ValueError(f"No Twitter ID for {username}: {rest_id}")
+    return rest_id
 
 
 @tool
@@ -99,10 +99,11 @@ def get_recent_tweets(restId: str):
     token = client.get_token(host='x.com', scopes=[
                              "profile", "tweet.read"])
 
-    response = client.make_request(
-        get_tweets_url, method="GET", token=token)
+    # tweets are picked out as the timeline streams in, the rest is never built
+    tweets = client.stream_request(
+        get_tweets_url, TWEET_PATH, fields=TWEET_FIELDS, method="GET", token=token)
 
-    return extract_tweet_info(response)["tweets"]
+    return collect_tweet_info(tweets)["tweets"]
 
 
 @tool
@@ -201,19 +202,17 @@ def search_piazza(query: str):
     token = client.get_token(host='piazza.com', scopes=[
                              'profile', 'posts'])
 
-    response = client.make_request(
-        url, method="POST", token=token, body=payload)
-
-    extracted_data = [
-        {
-            "subject": item["subject"],
-            # Use get() to handle missing keys
-            "content_snipet": item.get("content_snipet", ""),
-            "id": item["id"]
-        }
-        # Safely handle missing 'result' key
-        for item in response.get("result", [])
-    ]
+    # projected by the proxy, only the three kept keys of each result come
+    # back, error responses come back whole
+    extracted_data = client.make_request(
+        url, method="POST", token=token, body=payload,
+        select=PIAZZA_RESULT_PATH, fields=PIAZZA_SEARCH_FIELDS)
+    if not isinstance(extracted_data, list):
+        raise ValueError(f"No Piazza results for {query}: {extracted_data}")
+
+    for item in extracted_data:
+        if item["content_snipet"] is None:
+            item["content_snipet"] = ""
 
     return extracted_data[5]
 
@@ -1,5 +1,4 @@
-import pickle
-from pathlib import Path
+from session_db import SessionDatabase
 
 # Create test session
 session_data = {
@@ -9,10 +8,6 @@ session_data = {
 }
 
 # Save it
-sessions_dir = Path("captured_sessions")
-sessions_dir.mkdir(exist_ok=True)
-
-# The host will be converted from e.g. 'api.example.com' to 'api_example_com.pkl'
+# The host is indexed by its normalized key, e.g. 'api.example.com' -> 'api_example_com'
 host = "localhost8001"
-with open(sessions_dir / f"{host}.pkl", "wb") as f:
-    pickle.dump(session_data, f)
+SessionDatabase().put(host, session_data)
@@ -0,0 +1,111 @@
+# replay recorded flows through the legacy list-based capture check and the
+# compiled CaptureRules matcher
+#
+#   python proxy/benchmarks/bench_capture_rules.py [--flows recorded.jsonl] [--extra-hosts 200]
+#
+# a recorded flow is one JSON object per line:
+#   {"host": "x.com", "cookies": [["ct0", "..."]], "headers": [["user-agent", "..."]]}
+# without --flows a browsing-like mix is generated, mostly third-party hosts
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from capture_config import CaptureRules, load_rules  # noqa: E402
+
+LEGACY_HOSTS = ["www.linkedin.com", "x.com"]
+LEGACY_COOKIES = {
+    'www.linkedin.com': ['li_at', 'JSESSIONID', 'bcookie'],
+    'x.com': ['auth_token', 'ct0', 'twid', 'guest_id']
+}
+LEGACY_HEADERS = {
+    'www.linkedin.com': ['csrf-token', 'user-agent'],
+    'x.com': ['x-csrf-token', 'x-twitter-client-language', 'authorization', 'user-agent']
+}
+
+
+def synthesize(count: int):
+    rng = random.Random(0)
+    third_party = [f"cdn{i}.example{i % 50}.com" for i in range(400)] + [
+        "abs.twimg.com", "pbs.twimg.com", "static.licdn.com", "www.google-analytics.com"]
+    captured = ["x.com", "www.linkedin.com", "api.x.com", "media.linkedin.com"]
+    headers = [["user-agent", "Mozilla/5.0"], ["accept", "*/*"], ["accept-language", "en"],
+               ["x-csrf-token", "t"], ["authorization", "Bearer a"], ["csrf-token", "c"],
+               ["referer", "https://x.com/"], ["sec-fetch-mode", "cors"]]
+    cookies = [["ct0", "c"], ["auth_token", "a"], ["li_at", "l"], ["JSESSIONID", "j"],
+               ["_ga", "g"], ["personalization_id", "p"], ["lang", "en"]]
+    for _ in range(count):
+        host = rng.choice(captured) if rng.random() < 0.1 else rng.choice(third_party)
+        yield {"host": host, "cookies": cookies, "headers": headers}
+
+
+def add_extra_hosts(count: int, rules) -> None:
+    """Configure more captured hosts, as a deployment covering many sites would"""
+    for i in range(count):
+        host = f"www.site{i}.com"
+        LEGACY_HOSTS.append(host)
+        LEGACY_COOKIES[host] = ["session", "csrf"]
+        LEGACY_HEADERS[host] = ["x-csrf-token", "user-agent"]
+        rules[f"*.site{i}.com"] = {"cookies": ["session", "csrf"],
+                                   "headers": ["x-csrf-token", "user-agent"]}
+
+
+def legacy(flow) -> int:
+    host = flow["host"]
+    if host not in LEGACY_HOSTS:
+        return 0
+    kept = 0
+    for name, _ in flow["cookies"]:
+        if name in LEGACY_COOKIES[host]:
+            kept += 1
+    for name, _ in flow["headers"]:
+        if name in LEGACY_HEADERS[host]:
+            kept += 1
+    return kept
+
+
+def compiled(flow) -> int:
+    rule = capture_rules.match(flow["host"])
+    if rule is None:
+        return 0
+    kept = 0
+    for name, _ in flow["cookies"]:
+        if name.lower() in rule.cookies:
+            kept += 1
+    for name, _ in flow["headers"]:
+        if name.lower() in rule.headers:
+            kept += 1
+    return kept
+
+
+def replay(flows, check):
+    start = time.perf_counter()
+    kept = sum(check(flow) for flow in flows)
+    return (time.perf_counter() - start) / len(flows) * 1e9, kept
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=Path)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--extra-hosts", type=int, default=0)
+    args = parser.parse_args()
+
+    hosts = load_rules()["hosts"]
+    add_extra_hosts(args.extra_hosts, hosts)
+    capture_rules = CaptureRules(hosts)
+
+    if args.flows:
+        with open(args.flows) as f:
+            flows = [json.loads(line) for line in f if line.strip()]
+    else:
+        flows = list(synthesize(args.count))
+
+    for name, check in (("legacy", legacy), ("compiled", compiled)):
+        ns, kept = replay(flows, check)
+        print(f"{name:<9} {ns:8.1f} ns/flow  captured values={kept}")
@@ -0,0 +1,65 @@
+# JSON work on the proxy -> client path for large UserTweets timelines
+#
+#   python proxy/benchmarks/bench_json_codec.py --tweets 20 100 1000 --rounds 20
+#
+# proxy side: decode + re-encode with either codec against passing the
+# upstream bytes through untouched; client side: stdlib json against orjson
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import codec  # noqa: E402
+from fake_upstream import user_tweets_payload  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_roundtrip(body: bytes) -> bytes:
+    return json.dumps(json.loads(body), ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def orjson_roundtrip(body: bytes) -> bytes:
+    return orjson.dumps(orjson.loads(body))
+
+
+def passthrough(body: bytes) -> bytes:
+    return body
+
+
+def timed(fn, body: bytes, rounds: int) -> float:
+    fn(body)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(body)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tweets", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--text-size", type=int, default=280)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [("proxy stdlib decode+encode", stdlib_roundtrip),
+             ("proxy passthrough", passthrough),
+             ("client stdlib decode", json.loads)]
+    if orjson is not None:
+        cases[1:1] = [("proxy orjson decode+encode", orjson_roundtrip)]
+        cases.append(("client orjson decode", orjson.loads))
+    print(f"codec in use: {'orjson' if codec.USE_ORJSON else 'stdlib'}")
+
+    for count in args.tweets:
+        body = json.dumps(user_tweets_payload(count, args.text_size)).encode()
+        print(f"\n{count} tweets, {len(body) / 1024:.0f} KiB")
+        for name, fn in cases:
+            print(f"  {name:<30} {timed(fn, body, args.rounds):9.3f} ms")
@@ -0,0 +1,264 @@
+# end-to-end load test of proxy/main.py against a local fake upstream
+#
+#   python proxy/benchmarks/bench_load.py --concurrency 32 --duration 10 --output run.json
+#   python proxy/benchmarks/bench_load.py --scenarios user_by_screen_name piazza_search
+#   python proxy/benchmarks/bench_load.py --compare baseline.json
+#
+# The proxy and the fake upstream each run in their own uvicorn process and
+# the load generator drives both over loopback. Every scenario reports
+# requests/s, p50/p99 latency in milliseconds, non-200 responses and the
+# proxy's resident memory; the JSON written by --output is what --compare reads.
+#
+# Rate limits for the fake upstream are lifted unless --rate-limits is given,
+# so the numbers measure the proxy rather than the configured throttling.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+PROXY_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(PROXY_DIR))
+
+from capture_config import RULES_PATH  # noqa: E402
+from session_db import SessionDatabase  # noqa: E402
+
+SESSIONS = {
+    "x.com": {"cookies": {"ct0": "bench", "auth_token": "bench"},
+              "headers": {"x-csrf-token": "bench"}},
+    "piazza.com": {"cookies": {"session_id": "bench"}, "headers": {}},
+}
+
+# name -> (session host, method, upstream path, body)
+SCENARIOS = {
+    "grant_flow": ("x.com", "GET", "/i/api/graphql/bench/UserByScreenName", None),
+    "user_by_screen_name": ("x.com", "GET", "/i/api/graphql/bench/UserByScreenName", None),
+    "user_tweets_large": ("x.com", "GET", "/i/api/graphql/bench/UserTweets?count=2000", None),
+    "piazza_online_users": ("piazza.com", "POST", "/logic/api?method=network.get_online_users",
+                            {"method": "network.get_online_users", "params": {"nid": "bench"}}),
+    "piazza_search": ("piazza.com", "POST", "/logic/api?method=network.search&results=200",
+                      {"method": "network.search", "params": {"nid": "bench", "query": "exam"}}),
+    "slow_upstream": ("x.com", "GET", "/slow?delay=0.05", None),
+    # a 500 is relayed inside a 200 without retries and is not a circuit breaker
+    # failure, so this measures the error path, not errors; a 502/503/504 would
+    # be retried and open the breaker for every scenario on the fake upstream
+    "upstream_error": ("x.com", "GET", "/error?status=500", None),
+}
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak resident memory of a process, from /proc where available"""
+    usage = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    usage["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+def start_server(app: str, app_dir: Path, port: int, cwd: Path, env: Dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", str(app_dir),
+         "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, path: str = "/docs") -> None:
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            await client.get(path)
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def grant(client: httpx.AsyncClient, host: str) -> str:
+    r = await client.get("/oauth/authorize", params={
+        "client_id": "bench", "redirect_uri": "http://localhost/cb", "host": host})
+    if r.status_code != 307:
+        raise RuntimeError(f"authorize failed for {host}: {r.status_code} {r.text}")
+    code = parse_qs(urlparse(r.headers["location"]).query)["code"][0]
+    r = await client.post("/oauth/token", params={
+        "code": code, "client_id": "bench", "redirect_uri": "http://localhost/cb"})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, upstream: str,
+                       tokens: Dict[str, str], args) -> Dict:
+    host, method, path, body = SCENARIOS[name]
+    params = {"url": upstream + path, "method": method}
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def one() -> int:
+        if name == "grant_flow":
+            # every iteration authorizes, redeems the code and makes one call
+            token = await grant(client, host)
+        else:
+            token = tokens[host]
+        r = await client.post("/api/proxy", params=params, json=body,
+                              headers={"Authorization": f"Bearer {token}"})
+        await r.aread()
+        return r.status_code
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await one()
+            except httpx.HTTPError:
+                status = 0
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    for _ in range(args.warmup):
+        await one()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def drive(proxy_url: str, upstream_url: str, proxy_pid: int, args) -> Dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=proxy_url, limits=limits, timeout=60) as client:
+        await wait_ready(client)
+        async with httpx.AsyncClient(base_url=upstream_url) as upstream:
+            await wait_ready(upstream)
+        tokens = {host: await grant(client, host) for host in SESSIONS}
+
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, upstream_url, tokens, args)
+            results[name].update(rss_mb(proxy_pid))
+            print(f"{name:<22} {results[name]['rps']:9.1f} req/s  "
+                  f"p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms  "
+                  f"errors {results[name]['errors']:<6} rss {results[name]['rss_mb'] or 0:.1f} MB",
+                  file=sys.stderr)
+        return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROXY_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict) -> None:
+    """Print the relative change of every scenario present in both runs"""
+    print(f"{'scenario':<22} {'rps':>9} {'p50':>9} {'p99':>9} {'rss':>9}", file=sys.stderr)
+    for name, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        deltas = []
+        for metric in ("rps", "p50_ms", "p99_ms", "rss_mb"):
+            if before.get(metric) and result.get(metric) is not None:
+                deltas.append(f"{(result[metric] / before[metric] - 1) * 100:+8.1f}%")
+            else:
+                deltas.append(f"{'-':>9}")
+        print(f"{name:<22} " + " ".join(deltas), file=sys.stderr)
+
+
+def main(args) -> Dict:
+    run_dir = Path(tempfile.mkdtemp())
+    db = SessionDatabase(str(run_dir / "sessions.db"))
+    db.put_many(SESSIONS)
+    db.close()
+
+    rules = json.loads(RULES_PATH.read_text())
+    if not args.rate_limits:
+        rules["rate_limits"]["127.0.0.1"] = {
+            "host_rps": 1e9, "host_burst": 1e9, "session_rps": 1e9, "session_burst": 1e9,
+            "max_concurrency": 10000, "max_backoff": 0}
+    rules_path = run_dir / "capture_rules.json"
+    rules_path.write_text(json.dumps(rules))
+
+    env = {**os.environ, "PROXY_CAPTURE_RULES": str(rules_path)}
+    upstream = start_server("fake_upstream:app", BENCH_DIR, args.upstream_port, run_dir, env)
+    proxy = start_server("main:app", PROXY_DIR, args.port, run_dir, env)
+    try:
+        scenarios = asyncio.run(drive(
+            f"http://127.0.0.1:{args.port}", f"http://127.0.0.1:{args.upstream_port}",
+            proxy.pid, args))
+    finally:
+        for server in (proxy, upstream):
+            server.terminate()
+            server.wait()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "rate_limits": args.rate_limits,
+            "env": {k: v for k, v in os.environ.items() if k.startswith("PROXY_")},
+        },
+        "scenarios": scenarios,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="requests before measuring")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the configured default rate limit for the fake upstream")
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--upstream-port", type=int, default=8101)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = main(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), report)
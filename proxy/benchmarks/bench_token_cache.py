@@ -0,0 +1,59 @@
+# time the get_token_data dependency with a cold and a warm verified-token cache
+#
+#   python proxy/benchmarks/bench_token_cache.py --tokens 1000 10000
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import jwt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# main creates its session directory relative to the working directory
+os.chdir(tempfile.mkdtemp())
+
+import main  # noqa: E402
+
+
+def make_tokens(count: int):
+    session = {
+        "cookies": {"auth_token": "a" * 40, "ct0": "c" * 160, "twid": "u%3D1", "guest_id": "v1%3A1"},
+        "headers": {"authorization": "Bearer " + "b" * 100, "user-agent": "Mozilla/5.0 " * 10}
+    }
+    exp = datetime.utcnow() + timedelta(hours=1)
+    return [
+        jwt.encode({"sub": f"client-{i}", "host": "x.com", "scope": "profile",
+                    "exp": exp, "session": session}, main.JWT_SECRET, algorithm="HS256")
+        for i in range(count)
+    ]
+
+
+async def verify_all(headers) -> float:
+    start = time.perf_counter()
+    for header in headers:
+        await main.get_token_data(header)
+    return (time.perf_counter() - start) / len(headers) * 1e6
+
+
+async def run(count: int):
+    headers = [f"Bearer {token}" for token in make_tokens(count)]
+    main.token_cache.entries.clear()
+    main.token_cache.max_size = 0
+    uncached = await verify_all(headers)
+    main.token_cache.max_size = count
+    cold = await verify_all(headers)
+    warm = await verify_all(headers)
+    print(f"{count:>6} tokens  no cache {uncached:7.2f} us  cold {cold:7.2f} us  warm {warm:7.2f} us/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+    for count in args.tokens:
+        asyncio.run(run(count))
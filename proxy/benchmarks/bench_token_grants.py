@@ -0,0 +1,101 @@
+# authorize -> token grants/sec against uvicorn with 1..N workers per storage backend
+#
+#   python proxy/benchmarks/bench_token_grants.py --workers 1 2 4 --storage memory:// sqlite
+#
+# "sqlite" uses a fresh database in the run directory, any other value is
+# passed through as PROXY_STORAGE_URL (e.g. redis://127.0.0.1:6379/0). With
+# memory:// codes issued by one worker fail on the others once workers > 1.
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+PROXY_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROXY_DIR))
+
+from session_db import SessionDatabase  # noqa: E402
+
+HOST = "x.com"
+SESSION = {"cookies": {"ct0": "token"}, "headers": {"x-csrf-token": "token"}}
+
+
+def seed_session(run_dir: Path) -> None:
+    # sessions always come from the session database, whatever the storage URL
+    db = SessionDatabase(str(run_dir / "sessions.db"))
+    db.put(HOST, SESSION)
+    db.close()
+
+
+async def grant(client: httpx.AsyncClient) -> bool:
+    r = await client.get("/oauth/authorize", params={
+        "client_id": "bench", "redirect_uri": "http://localhost/cb", "host": HOST})
+    if r.status_code != 307:
+        return False
+    code = parse_qs(urlparse(r.headers["location"]).query)["code"][0]
+    r = await client.post("/oauth/token", params={
+        "code": code, "client_id": "bench", "redirect_uri": "http://localhost/cb"})
+    return r.status_code == 200
+
+
+async def drive(port: int, total: int, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as client:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                await client.get("/docs")
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                return await grant(client)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+    return sum(results) / elapsed, results.count(False)
+
+
+def run(storage: str, workers: int, args) -> None:
+    run_dir = Path(tempfile.mkdtemp())
+    storage_url = f"sqlite:///{run_dir / 'proxy.db'}" if storage == "sqlite" else storage
+    seed_session(run_dir)
+
+    env = {**os.environ, "PROXY_STORAGE_URL": storage_url}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(PROXY_DIR),
+         "--port", str(args.port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=run_dir, env=env)
+    try:
+        rate, failed = asyncio.run(drive(args.port, args.grants, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{storage:<12} workers={workers}  {rate:8.1f} grants/s  failed={failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--storage", nargs="+", default=["memory://", "sqlite"])
+    parser.add_argument("--grants", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8102)
+    args = parser.parse_args()
+    for storage in args.storage:
+        for workers in args.workers:
+            run(storage, workers, args)
@@ -0,0 +1,59 @@
+# compare a fresh httpx.AsyncClient per request against the shared UpstreamPool
+#
+#   python proxy/benchmarks/bench_upstream_pool.py --requests 2000 --concurrency 50
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from upstream import UpstreamPool  # noqa: E402
+from fake_upstream import ServerThread, app  # noqa: E402
+
+
+async def drive(total: int, concurrency: int, fetch) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await fetch()
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main(args):
+    with ServerThread(app, port=args.port) as server:
+        url = f"{server.url}/i/api/graphql/abc/UserByScreenName"
+
+        async def fresh_client():
+            async with httpx.AsyncClient() as client:
+                return await client.get(url)
+
+        pool = UpstreamPool()
+        await pool.start()
+
+        async def pooled_client():
+            return await pool.client_for(url).get(url)
+
+        before = await drive(args.requests, args.concurrency, fresh_client)
+        after = await drive(args.requests, args.concurrency, pooled_client)
+        await pool.close()
+
+    print(f"client per request: {before:8.1f} req/s")
+    print(f"shared pool:        {after:8.1f} req/s  ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8101)
+    asyncio.run(main(parser.parse_args()))
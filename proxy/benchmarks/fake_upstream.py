@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+import uvicorn
+from fastapi import Body, FastAPI, Header, Response
+
+# local stand-in for the upstream APIs the proxy talks to
+
+app = FastAPI()
+
+
+@app.get("/i/api/graphql/{query_id}/UserByScreenName")
+async def user_by_screen_name(query_id: str):
+    return {"data": {"user": {"result": {"rest_id": "44196397"}}}}
+
+
+def _tweet(index: int, text_size: int) -> Dict:
+    return {
+        "entryId": f"tweet-{index}",
+        "content": {"itemContent": {"tweet_results": {"result": {
+            "rest_id": str(1800000000000000000 + index),
+            "core": {"user_results": {"result": {"legacy": {"screen_name": "bench"}}}},
+            "legacy": {
+                "full_text": f"tweet {index} " + "x" * text_size,
+                "favorite_count": index,
+                "retweet_count": index // 2
+            }
+        }}}}
+    }
+
+
+def user_tweets_payload(count: int = 20, text_size: int = 200) -> Dict:
+    """Timeline in the shape extract_tweet_info() walks, large with a high count"""
+    entries = [_tweet(i, text_size) for i in range(count)]
+    return {"data": {"user": {"result": {"timeline_v2": {"timeline": {"instructions": [
+        {"type": "TimelineClearCache"},
+        {"type": "TimelineAddEntries", "entries": entries}
+    ]}}}}}}
+
+
+@app.get("/i/api/graphql/{query_id}/UserTweets")
+async def user_tweets(query_id: str, count: int = 20, text_size: int = 200):
+    return user_tweets_payload(count, text_size)
+
+
+@app.post("/logic/api")
+async def piazza_logic_api(method: str, payload: Dict = Body(...), results: int = 20):
+    """Piazza's JSON-RPC style endpoint, the method is repeated in the query string"""
+    if method == "network.get_online_users":
+        return {"result": {"users": 42, "classSize": 350}, "error": None, "aid": "bench"}
+    if method == "network.search":
+        query = payload.get("params", {}).get("query", "")
+        return {"result": [
+            {"id": f"post{i}", "nr": i, "subject": f"{query} question {i}",
+             "content_snipet": "snippet " * 20}
+            for i in range(results)
+        ], "error": None, "aid": "bench"}
+    return {"result": None, "error": f"unknown method {method}", "aid": "bench"}
+
+
+@app.get("/error")
+async def error(status: int = 500):
+    return Response(
+        content=f'{{"error": "upstream failed with {status}"}}',
+        status_code=status,
+        media_type="application/json"
+    )
+
+
+@app.get("/cached/{name}")
+async def cached(name: str, if_none_match: str = Header(None)):
+    etag = f'"{name}-v1"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=f'{{"name": "{name}"}}',
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "max-age=1"}
+    )
+
+
+@app.get("/slow")
+async def slow(delay: float = 0.2):
+    await asyncio.sleep(delay)
+    return {"slept": delay}
+
+
+class ServerThread:
+    """Run a uvicorn server on a background thread for the duration of a benchmark"""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 8101):
+        self.host = host
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
@@ -0,0 +1,95 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional
+
+# per-host capture rules and upstream limits, shared by the session
+# capturer and the proxy, loaded from capture_rules.json (or the file
+# named by PROXY_CAPTURE_RULES)
+#
+# host patterns:
+#   "x.com"            x.com and www.x.com
+#   "*.linkedin.com"   linkedin.com and every subdomain of it
+#
+# rate limits, the proxy queues requests beyond these instead of rejecting them:
+#   host_rps / host_burst        token bucket shared by every session on the host
+#   session_rps / session_burst  token bucket for each captured session
+#   max_concurrency              upstream requests in flight to the host
+#   max_backoff                  longest pause taken after a 429, in seconds
+
+RULES_PATH = Path(os.environ.get(
+    "PROXY_CAPTURE_RULES", Path(__file__).resolve().parent / "capture_rules.json"))
+
+# hosts looked up before the per-host match cache is reset
+MATCH_CACHE_SIZE = 4096
+_UNSEEN = object()
+
+
+class CaptureRule:
+    """What to capture for one domain, names are kept lowercase for matching"""
+
+    __slots__ = ("domain", "cookies", "headers")
+
+    def __init__(self, domain: str, cookies, headers):
+        self.domain = domain
+        self.cookies: FrozenSet[str] = frozenset(name.lower() for name in cookies)
+        self.headers: FrozenSet[str] = frozenset(name.lower() for name in headers)
+
+
+class CaptureRules:
+    """Precompiled host matcher.
+
+    Exact domains live in one dict and wildcard domains in another keyed by
+    suffix, so a host is matched with one lookup per label. Results are
+    memoized per host, which makes the check for hosts we do not capture a
+    single dict lookup on the hot path.
+    """
+
+    def __init__(self, hosts: Dict[str, Dict]):
+        self.exact: Dict[str, CaptureRule] = {}
+        self.wildcard: Dict[str, CaptureRule] = {}
+        for pattern, spec in hosts.items():
+            pattern = pattern.lower()
+            if pattern.startswith("*."):
+                domain = pattern[2:]
+                self.wildcard[domain] = CaptureRule(
+                    domain, spec.get("cookies", []), spec.get("headers", []))
+            else:
+                domain = pattern.removeprefix("www.")
+                self.exact[domain] = CaptureRule(
+                    domain, spec.get("cookies", []), spec.get("headers", []))
+        self.cache: Dict[str, Optional[CaptureRule]] = {}
+
+    def _lookup(self, host: str) -> Optional[CaptureRule]:
+        host = host.lower().rstrip(".")
+        rule = self.exact.get(host.removeprefix("www."))
+        if rule is not None:
+            return rule
+        # walk suffixes from the full host down, the most specific wildcard wins
+        labels = host.split(".")
+        for i in range(len(labels) - 1):
+            rule = self.wildcard.get(".".join(labels[i:]))
+            if rule is not None:
+                return rule
+        return None
+
+    def match(self, host: str) -> Optional[CaptureRule]:
+        rule = self.cache.get(host, _UNSEEN)
+        if rule is not _UNSEEN:
+            return rule
+        if len(self.cache) >= MATCH_CACHE_SIZE:
+            self.cache.clear()
+        rule = self.cache[host] = self._lookup(host)
+        return rule
+
+
+def load_rules(path: Path = RULES_PATH) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+_rules = load_rules()
+
+capture_rules = CaptureRules(_rules["hosts"])
+default_rate_limit = _rules["default_rate_limit"]
+rate_limits = _rules["rate_limits"]
@@ -0,0 +1,50 @@
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+import config
+
+# JSON encoding and decoding for proxy bodies, orjson when it is installed
+# and enabled (PROXY_JSON_CODEC=orjson, the default), the stdlib otherwise
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+USE_ORJSON = ORJSON_AVAILABLE and config.JSON_CODEC == "orjson"
+
+
+def loads(data: bytes) -> Any:
+    if USE_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the stdlib (lone surrogates, for one), let the stdlib decide
+            pass
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON, the same bytes Starlette's JSONResponse would produce"""
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(JSONResponse):
+    """JSON response for a body that is already encoded, sent as is"""
+
+    def render(self, content: bytes) -> bytes:
+        return content
@@ -0,0 +1,134 @@
+import os
+from typing import Dict
+
+# proxy tunables, overridable through the environment
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _env_host_map(name: str) -> Dict[str, float]:
+    """Parse "x.com=300,linkedin.com=60" into a per-host mapping"""
+    mapping = {}
+    for item in os.environ.get(name, "").split(","):
+        if "=" in item:
+            host, value = item.split("=", 1)
+            mapping[host.strip().lower().removeprefix("www.")] = float(value)
+    return mapping
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+# --- Upstream connection pool ---
+
+UPSTREAM_MAX_CONNECTIONS = _env_int("PROXY_UPSTREAM_MAX_CONNECTIONS", 100)
+UPSTREAM_MAX_KEEPALIVE = _env_int("PROXY_UPSTREAM_MAX_KEEPALIVE", 20)
+UPSTREAM_KEEPALIVE_EXPIRY = _env_float("PROXY_UPSTREAM_KEEPALIVE_EXPIRY", 30.0)
+UPSTREAM_CONNECT_TIMEOUT = _env_float("PROXY_UPSTREAM_CONNECT_TIMEOUT", 5.0)
+UPSTREAM_READ_TIMEOUT = _env_float("PROXY_UPSTREAM_READ_TIMEOUT", 30.0)
+UPSTREAM_POOL_TIMEOUT = _env_float("PROXY_UPSTREAM_POOL_TIMEOUT", 10.0)
+UPSTREAM_HTTP2 = _env_bool("PROXY_UPSTREAM_HTTP2", True)
+# hosts with a pooled client, the least recently used one is closed beyond
+# this, so at most UPSTREAM_MAX_HOSTS * UPSTREAM_MAX_CONNECTIONS are open
+UPSTREAM_MAX_HOSTS = _env_int("PROXY_UPSTREAM_MAX_HOSTS", 64)
+
+# --- Session store ---
+
+SESSION_DB_PATH = os.environ.get("PROXY_SESSION_DB", "sessions.db")
+SESSION_CACHE_SIZE = _env_int("PROXY_SESSION_CACHE_SIZE", 1024)
+# cookies rotated by upstream Set-Cookie are written back to the stored session
+SESSION_WRITEBACK = _env_bool("PROXY_SESSION_WRITEBACK", True)
+# seconds before a token's embedded session is checked against the store again
+SESSION_RECHECK_INTERVAL = _env_float("PROXY_SESSION_RECHECK_INTERVAL", 5.0)
+
+# --- Tokens ---
+
+# reference tokens carry only a session handle, the proxy resolves the
+# cookies and headers from the session store on every call
+REFERENCE_TOKENS = _env_bool("PROXY_REFERENCE_TOKENS", False)
+TOKEN_CACHE_SIZE = _env_int("PROXY_TOKEN_CACHE_SIZE", 10000)
+
+# --- Proxy responses ---
+
+# pass upstream bytes through unparsed, with the upstream status and
+# content-type, unless a request asks otherwise with ?stream=
+STREAM_RESPONSES = _env_bool("PROXY_STREAM_RESPONSES", False)
+STREAM_CHUNK_SIZE = _env_int("PROXY_STREAM_CHUNK_SIZE", 64 * 1024)
+
+# "orjson" (used when installed) or "stdlib" for decoding and encoding bodies;
+# JSON upstream bodies are passed through without decoding at all unless the
+# proxy has to change them. orjson reads integers wider than 64 bits as floats,
+# use "stdlib" if an upstream sends those and they must survive a batch call
+JSON_CODEC = os.environ.get("PROXY_JSON_CODEC", "orjson").lower()
+
+# --- Batch proxy ---
+
+BATCH_MAX_ITEMS = _env_int("PROXY_BATCH_MAX_ITEMS", 100)
+BATCH_CONCURRENCY = _env_int("PROXY_BATCH_CONCURRENCY", 8)
+
+# --- Response cache ---
+
+# cache successful GETs per session, honouring upstream Cache-Control, ETag
+# and Last-Modified; streamed responses bypass the cache
+RESPONSE_CACHE_ENABLED = _env_bool("PROXY_RESPONSE_CACHE", False)
+RESPONSE_CACHE_MAX_BYTES = _env_int("PROXY_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+RESPONSE_CACHE_MAX_ENTRY_BYTES = _env_int("PROXY_RESPONSE_CACHE_MAX_ENTRY_BYTES", 4 * 1024 * 1024)
+# per-host freshness in seconds, overrides whatever the upstream sends
+RESPONSE_CACHE_HOST_TTL = _env_host_map("PROXY_RESPONSE_CACHE_HOST_TTL")
+
+# --- Request coalescing ---
+
+# identical concurrent GET/HEAD/OPTIONS calls under the same session share
+# one upstream request
+SINGLE_FLIGHT_ENABLED = _env_bool("PROXY_SINGLE_FLIGHT", True)
+
+# --- Storage ---
+
+# where authorization codes live: memory://, sqlite:///path/to/proxy.db or
+# redis://host:6379/0; sessions are always read from SESSION_DB_PATH
+STORAGE_URL = os.environ.get("PROXY_STORAGE_URL", "memory://")
+AUTH_CODE_TTL = _env_float("PROXY_AUTH_CODE_TTL", 600)
+AUTH_CODE_SWEEP_INTERVAL = _env_float("PROXY_AUTH_CODE_SWEEP_INTERVAL", 30)
+
+# --- Upstream resilience ---
+
+# idempotent requests are retried on transport errors and 502/503/504 with
+# full-jitter exponential backoff; GET/HEAD/OPTIONS still waiting after the
+# host's recent p95 latency get one hedged duplicate
+UPSTREAM_RETRIES = _env_int("PROXY_UPSTREAM_RETRIES", 2)
+UPSTREAM_RETRY_BACKOFF = _env_float("PROXY_UPSTREAM_RETRY_BACKOFF", 0.1)
+UPSTREAM_RETRY_MAX_BACKOFF = _env_float("PROXY_UPSTREAM_RETRY_MAX_BACKOFF", 2.0)
+UPSTREAM_HEDGE = _env_bool("PROXY_UPSTREAM_HEDGE", True)
+UPSTREAM_HEDGE_MIN_DELAY = _env_float("PROXY_UPSTREAM_HEDGE_MIN_DELAY", 0.05)
+UPSTREAM_HEDGE_MIN_SAMPLES = _env_int("PROXY_UPSTREAM_HEDGE_MIN_SAMPLES", 20)
+# consecutive failures before a host fails fast, and for how long
+BREAKER_FAILURE_THRESHOLD = _env_int("PROXY_BREAKER_FAILURE_THRESHOLD", 5)
+BREAKER_RESET_TIMEOUT = _env_float("PROXY_BREAKER_RESET_TIMEOUT", 30.0)
+
+# --- Observability ---
+
+# proxy log records are one JSON object per line; debug and info records on
+# the request path are sampled so verbose levels stay usable under load
+LOG_LEVEL = os.environ.get("PROXY_LOG_LEVEL", "WARNING").upper()
+LOG_SAMPLE_RATE = _env_float("PROXY_LOG_SAMPLE_RATE", 1.0)
+# upstream hosts that get their own metrics label, later ones share "other"
+METRICS_MAX_HOSTS = _env_int("PROXY_METRICS_MAX_HOSTS", 100)
+# opt-in profiling: per-request Server-Timing headers and a log of the slowest
+# recent requests, both also switchable at runtime through /debug/profiling
+PROFILING = _env_bool("PROXY_PROFILING", False)
+PROFILING_SLOW_REQUESTS = _env_int("PROXY_PROFILING_SLOW_REQUESTS", 50)
+PROFILING_SLOW_WINDOW = _env_float("PROXY_PROFILING_SLOW_WINDOW", 300.0)
+# seconds between stack samples of the sampling profiler
+PROFILER_INTERVAL = _env_float("PROXY_PROFILER_INTERVAL", 0.005)
+# the /debug endpoints answer 404 unless enabled
+DEBUG_ENDPOINTS = _env_bool("PROXY_DEBUG_ENDPOINTS", False)
@@ -1,29 +1,25 @@
 # openup the output file from the chrome extension
 # iterate over each host in the dict
-# for each host, save the cookies and headers as a pickle file
-# the filename should be the host, with periods replaced with underscores
+# for each host, save the cookies and headers to the session database
+# (kept under its old name, sessions are no longer written as pickle files)
 
 
-import json
-import pickle
+import sys
 from pathlib import Path
 import os
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from session_db import SessionDatabase  # noqa: E402
+
 
 input_file = Path("proxy/output.json")
-output_dir = Path("proxy/captured_sessions")
-output_dir.mkdir(exist_ok=True)
+db = SessionDatabase(os.environ.get("PROXY_SESSION_DB", "proxy/sessions.db"))
 
 print(f"Current working directory: {os.getcwd()}")
 print(f"Input file path: {input_file.resolve()}")
-print(f"Output directory path: {output_dir.resolve()}")
-
-with open(input_file, "r") as f:
-    data = json.load(f)
+print(f"Session database path: {Path(db.path).resolve()}")
 
-for host, session in data.items():
-    output_file = output_dir / Path(f"{host.replace('.', '_')}.pkl")
-    with open(output_file, "wb") as f:
-        pickle.dump(session, f)
+count = db.import_file(input_file, force=True)
 
-print(f"Saved {len(data)} sessions to {output_dir}")
+print(f"Saved {count} sessions to {db.path}")
@@ -0,0 +1,50 @@
+import json
+import logging
+import random
+import sys
+
+import config
+
+# structured proxy logging, one JSON object per record
+#
+#   PROXY_LOG_LEVEL=DEBUG PROXY_LOG_SAMPLE_RATE=0.01   log 1% of proxied calls
+
+logger = logging.getLogger("proxy")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {})
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(level: str = config.LOG_LEVEL) -> None:
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+def log_event(level: int, event: str, exc_info: bool = False, **fields) -> None:
+    """Log an event with structured fields.
+
+    Checks the level before building anything, so a disabled level costs one
+    comparison; records below WARNING are kept at PROXY_LOG_SAMPLE_RATE.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and random.random() >= config.LOG_SAMPLE_RATE:
+        return
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+
+configure()
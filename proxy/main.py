@@ -1,15 +1,36 @@
-import json
-from fastapi import FastAPI, HTTPException, Header, Depends
-from fastapi.responses import RedirectResponse
+import asyncio
+import logging
+import math
+import time
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Optional, List
+from starlette.background import BackgroundTask
+from typing import Any, Callable, Dict, Optional, List
 import jwt
 from datetime import datetime, timedelta
-import pickle
 from pathlib import Path
 import httpx
 import secrets
-from urllib.parse import urljoin
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin, urlparse
+
+import codec
+import config
+import metrics
+import profiling
+from logs import log_event
+from projection import Projection, make_projection
+from ratelimit import RateLimiter
+from resilience import CircuitOpenError, Resilience
+from response_cache import ResponseCache, session_identity
+from singleflight import SingleFlight
+from session_db import SessionDatabase, normalize_host, session_key
+from session_refresh import SessionRefresher
+from storage import MemoryBackend, open_backend
+from token_cache import VerifiedTokenCache
+from upstream import UpstreamPool, session_headers
 
 
 class SessionCapture(BaseModel):
@@ -25,59 +46,193 @@ class TokenResponse(BaseModel):
     scope: str
 
 
+class ProxyRequestItem(BaseModel):
+    url: str
+    method: str = "GET"
+    body: Optional[Dict] = None
+    select: Optional[str] = None
+    fields: Optional[str] = None
+
+
+class BatchProxyRequest(BaseModel):
+    requests: List[ProxyRequestItem]
+    concurrency: Optional[int] = None
+
+
+class ProxyResult(BaseModel):
+    status: int
+    body: Any = None
+    error: Optional[str] = None
+    attempts: int = 1
+    hedged: bool = False
+
+
 # --- Session Storage ---
 
 
 class SessionStore:
-    def __init__(self, sessions_dir: Path = Path("captured_sessions")):
-        self.sessions_dir = sessions_dir
-        self.sessions_dir.mkdir(exist_ok=True)
-
-    def get_session(self, host: str) -> Optional[Dict]:
-        normalized_host = host.lstrip('www.')
-        filename = normalized_host.replace('.', '_').replace(':', '_') + '.pkl'
-        try:
-            with open(self.sessions_dir / filename, 'rb') as f:
-                return pickle.load(f)
-        except (FileNotFoundError, EOFError) as e:
-            print(f"Error loading session for {host}: {e}")
+    """Sessions from the single-file session database, with an LRU cache in front.
+
+    The cache is dropped whenever another process commits to the database,
+    so sessions re-captured by session_capturer.py or imported from
+    output.json are picked up on the next lookup. Writes can wait on the
+    database lock, so they run in a worker thread.
+    """
+
+    def __init__(self, db: Optional[SessionDatabase] = None, cache_size: int = config.SESSION_CACHE_SIZE):
+        self.db = db or SessionDatabase()
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.data_version = None
+        self.hits = 0
+        self.misses = 0
+
+    @metrics.timed("session_lookup")
+    async def get_session(self, host: str) -> Optional[Dict]:
+        key = session_key(host)
+        data_version = self.db.data_version()
+        if data_version != self.data_version:
+            self.cache.clear()
+            self.data_version = data_version
+
+        session = self.cache.get(key)
+        if session is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return session
+
+        self.misses += 1
+        session = self.db.get(key)
+        if session is None:
+            log_event(logging.WARNING, "session_missing", host=host, source=self.db.path)
             return None
 
+        self.cache[key] = session
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return session
+
+    async def put_session(self, host: str, session: Dict) -> None:
+        await asyncio.to_thread(self.db.put, host, session)
+        self.cache.pop(session_key(host), None)
+
+    async def merge_cookies(self, host: str, cookies: Dict[str, Optional[str]]) -> Optional[Dict]:
+        session = await asyncio.to_thread(self.db.merge_cookies, host, cookies)
+        # drop the cached copy now rather than at the next data_version check
+        self.cache.pop(session_key(host), None)
+        return session
+
+    def cache_info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.cache),
+            "max_size": self.cache_size
+        }
+
+
 # --- OAuth Implementation ---
 
 
 class AuthCodeStore:
-    def __init__(self):
-        self.codes: Dict[str, Dict] = {}
+    """One-time authorization codes with a TTL, kept in a storage backend"""
+
+    def __init__(self, backend=None, ttl: float = config.AUTH_CODE_TTL):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.expired = 0
 
-    def create_code(self, client_id: str, host: str, scopes: List[str]) -> str:
+    async def create_code(self, client_id: str, host: str, scopes: List[str]) -> str:
         code = secrets.token_urlsafe(32)
-        self.codes[code] = {
+        await self.backend.put(f"code:{code}", {
             "client_id": client_id,
             "host": host,
             "scopes": scopes,
-            "created_at": datetime.now()
-        }
+            "created_at": datetime.now().timestamp()
+        }, ttl=self.ttl)
         return code
 
-    def validate_code(self, code: str, client_id: str) -> Optional[Dict]:
-        code_data = self.codes.get(code)
+    async def validate_code(self, code: str, client_id: str) -> Optional[Dict]:
+        # consumed atomically, a code can be redeemed at most once on any worker
+        code_data = await self.backend.take(f"code:{code}")
         if not code_data or code_data["client_id"] != client_id:
             return None
-        if datetime.now() - code_data["created_at"] > timedelta(minutes=10):
-            return None
-        del self.codes[code]
         return code_data
 
+    async def sweep(self) -> int:
+        """Remove codes that expired without being redeemed"""
+        removed = await self.backend.sweep()
+        self.expired += removed
+        return removed
+
+    async def stats(self) -> Dict[str, int]:
+        return {
+            "live": await self.backend.count("code:"),
+            "expired": self.expired
+        }
+
 
-app = FastAPI()
+storage = open_backend(config.STORAGE_URL)
 session_store = SessionStore()
-auth_codes = AuthCodeStore()
+auth_codes = AuthCodeStore(storage)
+upstream_pool = UpstreamPool()
+token_cache = VerifiedTokenCache()
+response_cache = ResponseCache()
+single_flight = SingleFlight()
+rate_limiter = RateLimiter()
+resilience = Resilience(throttled=rate_limiter.blocked)
+session_refresher = SessionRefresher(session_store)
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
 JWT_SECRET = "your-secret-key"  # Change in production
 
 
+async def sweep_auth_codes() -> None:
+    while True:
+        await asyncio.sleep(config.AUTH_CODE_SWEEP_INTERVAL)
+        try:
+            await auth_codes.sweep()
+        except Exception:
+            log_event(logging.ERROR, "auth_code_sweep_failed", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream_pool.start()
+    sweeper = asyncio.create_task(sweep_auth_codes())
+    yield
+    sweeper.cancel()
+    await upstream_pool.close()
+    await storage.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=codec.FastJSONResponse)
+INSTRUMENTED_ENDPOINTS = ["/oauth/authorize", "/oauth/token", "/api/proxy", "/api/proxy/batch"]
+app.add_middleware(metrics.MetricsMiddleware, endpoints=INSTRUMENTED_ENDPOINTS)
+app.add_middleware(profiling.ProfilingMiddleware, endpoints=INSTRUMENTED_ENDPOINTS)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(request: Request, e: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(max(math.ceil(e.retry_after), 1))}
+    )
+
+
+@app.exception_handler(httpx.TransportError)
+async def upstream_unreachable(request: Request, e: httpx.TransportError):
+    # retries are exhausted by the time this is raised
+    status = 504 if isinstance(e, httpx.TimeoutException) else 502
+    return JSONResponse(
+        status_code=status,
+        content={"detail": f"Upstream request failed: {str(e) or type(e).__name__}"}
+    )
+
+
 @app.get("/oauth/authorize")
 async def authorize(
+    request: Request,
     client_id: str,
     redirect_uri: str,
     host: str,
@@ -87,14 +242,16 @@ async def authorize(
     """Authorize endpoint that accepts space-separated scopes"""
     scopes = scope.split() if scope else ["default"]
 
-    session = session_store.get_session(host)
+    session = await session_store.get_session(host)
     if not session:
         raise HTTPException(
             status_code=400,
             detail=f"No valid session for {host}"
         )
+    # labelled only once the host is known, a random host must not add a series
+    request.state.metrics_host = metrics.host_label(host)
 
-    code = auth_codes.create_code(client_id, host, scopes)
+    code = await auth_codes.create_code(client_id, host, scopes)
 
     params = {"code": code}
     if state:
@@ -106,30 +263,36 @@ async def authorize(
 
 @app.post("/oauth/token")
 async def token(
+    request: Request,
     code: str,
     client_id: str,
     redirect_uri: str
 ):
     """Token endpoint that includes scopes in the JWT"""
-    code_data = auth_codes.validate_code(code, client_id)
+    code_data = await auth_codes.validate_code(code, client_id)
     if not code_data:
         raise HTTPException(
             status_code=401, detail="Invalid authorization code")
 
-    session = session_store.get_session(code_data["host"])
+    session = await session_store.get_session(code_data["host"])
     if not session:
         raise HTTPException(status_code=401, detail="Session not found")
+    request.state.metrics_host = metrics.host_label(code_data["host"])
 
     token_data = {
         "sub": client_id,
         "host": code_data["host"],
         "scope": " ".join(code_data["scopes"]),
-        "exp": datetime.utcnow() + timedelta(hours=1),
-        "session": {
+        "exp": datetime.utcnow() + timedelta(hours=1)
+    }
+    if config.REFERENCE_TOKENS:
+        token_data["sid"] = normalize_host(code_data["host"])
+    else:
+        token_data["session"] = {
             "cookies": session["cookies"],
-            "headers": session["headers"]
+            "headers": session["headers"],
+            "version": session.get("version", 0)
         }
-    }
 
     access_token = jwt.encode(token_data, JWT_SECRET, algorithm="HS256")
     return TokenResponse(
@@ -143,53 +306,363 @@ async def get_token_data(authorization: str = Header(...)) -> Dict:
         scheme, token = authorization.split()
         if scheme.lower() != "bearer":
             raise HTTPException(401, "Invalid auth scheme")
-        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        with metrics.stage("token_decode"):
+            token_data = token_cache.get(token)
+            if token_data is None:
+                token_data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+                token_cache.put(token, token_data)
+        return token_data
     except:
         raise HTTPException(401, "Invalid authorization header")
 
 
+async def resolve_session(token_data: Dict) -> Dict:
+    """Return the session for a token, embedded or looked up by its handle.
+
+    An embedded session is replaced by the stored one once cookies rotated
+    after the token was issued have been written back.
+    """
+    if "session" in token_data:
+        if config.SESSION_WRITEBACK:
+            return await session_refresher.current(token_data["host"], token_data["session"])
+        return token_data["session"]
+    session = await session_store.get_session(token_data["sid"])
+    if not session:
+        raise HTTPException(status_code=401, detail="Session not found")
+    return session
+
+
+async def write_back_cookies(token_data: Dict, session: Dict, response: httpx.Response) -> None:
+    """Keep the stored session in step with cookies the upstream rotated"""
+    if not config.SESSION_WRITEBACK:
+        return
+    try:
+        await session_refresher.write_back(token_data["host"], session, response)
+    except Exception:
+        # the proxied call itself succeeded, a failed write-back is retried on the next rotation
+        log_event(logging.ERROR, "session_writeback_failed",
+                  host=token_data["host"], exc_info=True)
+
+
+def upstream_url_error(url: str) -> Optional[str]:
+    """Why url cannot be proxied, None when it can"""
+    try:
+        parsed = httpx.URL(url)
+        urlparse(url)
+    except (httpx.InvalidURL, ValueError) as e:
+        return f"Invalid url: {e}"
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        return "Invalid url: expected an absolute http:// or https:// URL"
+    return None
+
+
+def build_upstream_request(session: Dict, url: str, method: str, body: Optional[Dict]) -> httpx.Request:
+    return upstream_pool.client_for(url).build_request(
+        method=method,
+        url=url,
+        headers=session_headers(session),
+        json=body if body else None
+    )
+
+
+async def dispatch(request: httpx.Request, session_id: str, stream: bool = False) -> httpx.Response:
+    """Send a request upstream with retries, hedging and the host and session rate limits"""
+    async def send(request: httpx.Request, admit: Callable[[], None]) -> httpx.Response:
+        # every attempt, retried or hedged, takes its own rate-limit slot
+        async with rate_limiter.acquire(request.url.host, session_id) as limiter:
+            admit()
+            start = time.perf_counter()
+            # connect and time-to-first-byte are timed from here, after any rate-limit wait
+            request.extensions["trace"] = metrics.UpstreamTrace()
+            # looked up per attempt, the host's client may have been evicted while queued
+            client = upstream_pool.client_for(str(request.url))
+            response = await client.send(request, stream=stream, follow_redirects=True)
+        limiter.observe(response)
+        metrics.UPSTREAM_RESPONSES.inc(
+            host=metrics.host_label(request.url.host), method=request.method, status=response.status_code)
+        log_event(logging.DEBUG, "upstream_response",
+                  host=request.url.host, method=request.method,
+                  status=response.status_code, elapsed=round(time.perf_counter() - start, 4))
+        return response
+
+    with metrics.stage("upstream"):
+        return await resilience.send(request, send)
+
+
+def upstream_headers(response: httpx.Response) -> Dict[str, str]:
+    """The upstream status, how many attempts the call took and whether a hedge answered it"""
+    headers = {"X-Upstream-Status": str(response.status_code),
+               "X-Upstream-Attempts": str(response.extensions.get("upstream_attempts", 1))}
+    if response.extensions.get("upstream_hedged"):
+        headers["X-Upstream-Hedged"] = "1"
+    return headers
+
+
+async def send_upstream(session: Dict, url: str, method: str, body: Optional[Dict]) -> httpx.Response:
+    """Send a buffered upstream request, coalesced and cached for safe methods"""
+    method = method.upper()
+    session_id = session_identity(session)
+    request = build_upstream_request(session, url, method, body)
+    if method not in SAFE_METHODS:
+        return await dispatch(request, session_id)
+
+    async def send() -> httpx.Response:
+        if config.RESPONSE_CACHE_ENABLED and method == "GET":
+            return await response_cache.send(
+                request, session_id,
+                lambda request: dispatch(request, session_id))
+        return await dispatch(request, session_id)
+
+    if config.SINGLE_FLIGHT_ENABLED and not body:
+        return await single_flight.do((session_id, method, url), send)
+    return await send()
+
+
+def is_json(response: httpx.Response) -> bool:
+    return response.headers.get("content-type", "").startswith("application/json")
+
+
+def decode_upstream_body(response: httpx.Response, projection: Optional[Projection] = None) -> Any:
+    """The upstream body, projected when given one and the upstream call succeeded"""
+    if not is_json(response):
+        return response.text
+    document = codec.loads(response.content)
+    # an error body would project to nothing, it is passed on as is
+    if projection is None or not response.is_success:
+        return document
+    return projection.apply(document)
+
+
+def encode_upstream_body(response: httpx.Response, projection: Optional[Projection] = None) -> bytes:
+    """The proxy's JSON body for an upstream response, JSON is only decoded to be projected"""
+    if not is_json(response):
+        return codec.dumps(response.text)
+    if projection is None or not response.is_success:
+        return response.content or b"null"
+    try:
+        return codec.dumps(decode_upstream_body(response, projection))
+    except ValueError:
+        raise HTTPException(status_code=502, detail="Upstream returned invalid JSON")
+
+
+def parse_projection(select: Optional[str], fields: Optional[str]) -> Optional[Projection]:
+    try:
+        return make_projection(select, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/api/proxy")
 async def proxy_request(
+    request: Request,
     url: str,
     method: str = "GET",
     token_data: Dict = Depends(get_token_data),
-    body: Optional[Dict] = None
+    body: Optional[Dict] = None,
+    stream: Optional[bool] = None,
+    select: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    """Proxy that supports all HTTP methods and passes through stored session data"""
-    session = token_data["session"]
-
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=method,
-            url=url,
-            cookies=session["cookies"],
-            headers=session["headers"],
-            json=body if body else None,
-            follow_redirects=True
+    """Proxy that supports all HTTP methods and passes through stored session data.
+
+    select and fields project JSON responses down to what the caller keeps
+    (see projection.py); projected responses are never streamed, and error
+    responses (X-Upstream-Status not 2xx) are sent back unprojected.
+    """
+    url_error = upstream_url_error(url)
+    if url_error:
+        raise HTTPException(status_code=400, detail=url_error)
+    request.state.metrics_host = metrics.host_label(url)
+    projection = parse_projection(select, fields)
+    session = await resolve_session(token_data)
+
+    if projection is None and (stream if stream is not None else config.STREAM_RESPONSES):
+        upstream_request = build_upstream_request(session, url, method, body)
+        response = await dispatch(
+            upstream_request, session_identity(session), stream=True)
+        await write_back_cookies(token_data, session, response)
+        return StreamingResponse(
+            response.aiter_bytes(config.STREAM_CHUNK_SIZE),
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type"),
+            headers=upstream_headers(response),
+            background=BackgroundTask(response.aclose)
         )
 
-        print(response, "from proxy")
+    response = await send_upstream(session, url, method, body)
+    await write_back_cookies(token_data, session, response)
 
-        if response.headers.get("content-type", "").startswith("application/json"):
-            return response.json()
-        return response.text
+    with metrics.stage("serialize"):
+        return codec.RawJSONResponse(
+            encode_upstream_body(response, projection),
+            headers=upstream_headers(response)
+        )
 
 
-if __name__ == "__main__":
-    input_file = Path("output.json")
-    output_dir = Path("captured_sessions")
-    output_dir.mkdir(exist_ok=True)
+@app.post("/api/proxy/batch")
+async def proxy_batch(
+    batch: BatchProxyRequest,
+    token_data: Dict = Depends(get_token_data)
+) -> List[ProxyResult]:
+    """Run several proxied calls concurrently under one token, results in request order"""
+    if len(batch.requests) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch is limited to {config.BATCH_MAX_ITEMS} requests"
+        )
+    projections = [parse_projection(item.select, item.fields) for item in batch.requests]
+    session = await resolve_session(token_data)
+    concurrency = min(batch.concurrency or config.BATCH_CONCURRENCY,
+                      config.BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(item: ProxyRequestItem, projection: Optional[Projection]) -> ProxyResult:
+        url_error = upstream_url_error(item.url)
+        if url_error:
+            return ProxyResult(status=400, error=url_error)
+        async with semaphore:
+            try:
+                response = await send_upstream(
+                    session, item.url, item.method, item.body)
+                await write_back_cookies(token_data, session, response)
+                return ProxyResult(
+                    status=response.status_code,
+                    body=decode_upstream_body(response, projection),
+                    attempts=response.extensions.get("upstream_attempts", 1),
+                    hedged=response.extensions.get("upstream_hedged", False)
+                )
+            except CircuitOpenError as e:
+                return ProxyResult(status=503, error=str(e))
+            except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
+                # a failed item is reported in place, the rest of the batch goes on
+                return ProxyResult(status=502, error=str(e) or type(e).__name__)
+
+    results = await asyncio.gather(
+        *(run(item, projection) for item, projection in zip(batch.requests, projections)))
+    with metrics.stage("serialize"):
+        return codec.FastJSONResponse([result.model_dump() for result in results])
+
+
+def export_cache(name: str, info: Dict[str, int]) -> None:
+    """Copy a cache_info() snapshot into the cache series, labelled cache=name"""
+    metrics.CACHE_HITS.set(info["hits"], cache=name)
+    metrics.CACHE_MISSES.set(info["misses"], cache=name)
+    metrics.CACHE_ENTRIES.set(info["size"], cache=name)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text exposition of the proxy's counters, histograms and gauges"""
+    connections: Dict = {}
+    for host, usage in upstream_pool.stats().items():
+        for state, count in usage.items():
+            key = (metrics.host_label(host), state)
+            connections[key] = connections.get(key, 0) + count
+    metrics.UPSTREAM_CONNECTIONS.clear()
+    for (host, state), count in connections.items():
+        metrics.UPSTREAM_CONNECTIONS.set(count, host=host, state=state)
+    export_cache("session", session_store.cache_info())
+    export_cache("token", token_cache.cache_info())
+    cached = response_cache.cache_info()
+    export_cache("response", {**cached, "size": cached["entries"]})
+    metrics.RESPONSE_CACHE_REVALIDATIONS.set(cached["revalidated"])
+    metrics.RESPONSE_CACHE_BYTES.set(cached["bytes"])
+    code_stats = await auth_codes.stats()
+    metrics.AUTH_CODES_LIVE.set(code_stats["live"])
+    metrics.AUTH_CODES_EXPIRED.set(code_stats["expired"])
+    circuit_states = {"closed": 0, "half_open": 1, "open": 2}
+    states: Dict[str, int] = {}
+    for host, health in resilience.stats().items():
+        # hosts past the label cap report the worst state among them
+        label = metrics.host_label(host)
+        states[label] = max(states.get(label, 0), circuit_states[health["state"]])
+    metrics.CIRCUIT_STATE.clear()
+    for host, state in states.items():
+        metrics.CIRCUIT_STATE.set(state, host=host)
+    # hosts sharing a label add up their counts, and report the tightest limit
+    limits: Dict[str, Dict] = {}
+    for host, stats in rate_limiter.stats().items():
+        label = metrics.host_label(host)
+        merged = limits.setdefault(label, {"rate": stats["rate"], "throttled": 0,
+                                           "queued": 0, "blocked_for": 0.0})
+        merged["rate"] = min(merged["rate"], stats["rate"])
+        merged["throttled"] += stats["throttled"]
+        merged["queued"] += stats["queued"]
+        merged["blocked_for"] = max(merged["blocked_for"], stats["blocked_for"])
+    for host, merged in limits.items():
+        metrics.RATE_LIMIT_RPS.set(merged["rate"], host=host)
+        metrics.RATE_LIMIT_THROTTLED.set(merged["throttled"], host=host)
+        metrics.RATE_LIMIT_QUEUED.set(merged["queued"], host=host)
+        metrics.RATE_LIMIT_BLOCKED.set(merged["blocked_for"], host=host)
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4"
+    )
 
-    with open(input_file, "r") as f:
-        data = json.load(f)
 
-    for host, session in data.items():
-        output_file = output_dir / \
-            Path(f"{host.replace('.', '_')}.pkl")
-        with open(output_file, "wb") as f:
-            pickle.dump(session, f)
+# --- Debug endpoints ---
 
-    print(f"Saved {len(data)} sessions to {output_dir}")
+
+async def require_debug_endpoints() -> None:
+    if not config.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+def profiling_status() -> Dict:
+    return {
+        "enabled": profiling.enabled,
+        "slow_requests": len(profiling.slow_requests.heap),
+        "profiler": profiling.profiler.status()
+    }
+
+
+@app.get("/debug/profiling", dependencies=[Depends(require_debug_endpoints)])
+async def get_profiling():
+    return profiling_status()
+
+
+@app.post("/debug/profiling", dependencies=[Depends(require_debug_endpoints)])
+async def set_profiling(enabled: bool):
+    """Turn Server-Timing headers and the slow request log on or off in this worker"""
+    profiling.enable(enabled)
+    return profiling_status()
+
+
+@app.get("/debug/slow-requests", dependencies=[Depends(require_debug_endpoints)])
+async def slow_requests():
+    """The slowest recent requests with their stage breakdown, credentials redacted"""
+    return profiling.slow_requests.snapshot()
+
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_debug_endpoints)])
+async def start_profiler(interval: Optional[float] = None, duration: Optional[float] = None):
+    """Start sampling the event loop, for `duration` seconds or until stopped"""
+    # called on the event loop thread, which is the one sampled
+    if not profiling.profiler.start(interval, duration):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return profiling.profiler.status()
+
+
+@app.post("/debug/profiler/stop", response_class=PlainTextResponse,
+          dependencies=[Depends(require_debug_endpoints)])
+async def stop_profiler():
+    profiling.profiler.stop()
+    return PlainTextResponse(profiling.profiler.collapsed())
+
+
+@app.get("/debug/profiler", response_class=PlainTextResponse,
+         dependencies=[Depends(require_debug_endpoints)])
+async def get_profile():
+    """Stacks sampled so far in collapsed format, one "frame;...;frame count" line each"""
+    return PlainTextResponse(profiling.profiler.collapsed())
+
+
+if __name__ == "__main__":
+    input_file = Path("output.json")
+    if input_file.exists():
+        # unchanged output.json files are not rewritten on every start
+        count = session_store.db.import_file(input_file)
+        print(f"Imported {count} sessions from {input_file}")
 
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
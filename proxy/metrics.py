@@ -0,0 +1,355 @@
+import bisect
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import config
+from profiling import record_span
+
+# in-process metrics in the Prometheus text exposition format, served on /metrics
+#
+#   proxy_requests_total            authorize, token and proxy calls by host, method and status
+#   proxy_request_duration_seconds  end-to-end latency per endpoint
+#   proxy_stage_duration_seconds    token_decode, session_lookup, upstream (all attempts
+#                                   and backoff), upstream_connect, upstream_ttfb,
+#                                   coalesced_wait (on another caller's identical request)
+#                                   and serialize
+#   proxy_upstream_responses_total  upstream responses by host, method and status
+#   proxy_upstream_connections      pooled connections per upstream host, active or idle
+#   proxy_auth_codes_live           authorization codes issued and not yet redeemed
+#   proxy_auth_codes_expired_total  authorization codes swept after expiring unredeemed
+#   proxy_upstream_retries_total    retried upstream attempts per host
+#   proxy_upstream_hedges_total     hedged requests per host, won or lost by the hedge
+#   proxy_circuit_rejections_total  requests failed fast by an open circuit
+#   proxy_circuit_state             0 closed, 1 half-open, 2 open
+#   proxy_session_writebacks_total  sessions updated with cookies rotated by upstream
+#   proxy_single_flight_leaders_total    upstream calls started for identical concurrent requests
+#   proxy_single_flight_collapsed_total  requests that waited on one of those calls instead
+#   proxy_cache_hits_total          lookups answered by an in-process cache, per cache
+#   proxy_cache_misses_total        lookups that fell through to the slower path, per cache
+#   proxy_cache_entries             entries held by each in-process cache
+#   proxy_response_cache_revalidations_total  stale responses renewed by a conditional request
+#   proxy_response_cache_bytes      body bytes held by the response cache
+#   proxy_rate_limit_rps            current request rate allowed per upstream host
+#   proxy_rate_limit_throttled_total  429 responses per upstream host
+#   proxy_rate_limit_queued_total   requests delayed by the rate limit per upstream host
+#   proxy_rate_limit_blocked_seconds  time left in a Retry-After pause per upstream host
+
+# seconds, from a warm cache hit up to a slow upstream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels) -> None:
+        """Copy a total that is counted elsewhere, such as a store's stats(), at scrape time"""
+        self.values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Point-in-time value, set when /metrics is scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram, each observation is one bisect and two adds"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "proxy_requests_total", "Calls to the authorize, token and proxy endpoints",
+    ("endpoint", "host", "method", "status")))
+REQUEST_LATENCY = registry.register(Histogram(
+    "proxy_request_duration_seconds", "End-to-end latency per endpoint",
+    ("endpoint",)))
+STAGE_LATENCY = registry.register(Histogram(
+    "proxy_stage_duration_seconds", "Latency of each stage of a proxied call",
+    ("stage",)))
+UPSTREAM_RESPONSES = registry.register(Counter(
+    "proxy_upstream_responses_total", "Responses received from upstream hosts",
+    ("host", "method", "status")))
+UPSTREAM_CONNECTIONS = registry.register(Gauge(
+    "proxy_upstream_connections", "Pooled upstream connections",
+    ("host", "state")))
+AUTH_CODES_LIVE = registry.register(Gauge(
+    "proxy_auth_codes_live", "Authorization codes issued and not yet redeemed"))
+AUTH_CODES_EXPIRED = registry.register(Counter(
+    "proxy_auth_codes_expired_total", "Authorization codes that expired without being redeemed"))
+UPSTREAM_RETRIES = registry.register(Counter(
+    "proxy_upstream_retries_total", "Retried upstream attempts", ("host",)))
+UPSTREAM_HEDGES = registry.register(Counter(
+    "proxy_upstream_hedges_total", "Hedged upstream requests", ("host", "outcome")))
+CIRCUIT_REJECTIONS = registry.register(Counter(
+    "proxy_circuit_rejections_total", "Requests failed fast by an open circuit", ("host",)))
+CIRCUIT_STATE = registry.register(Gauge(
+    "proxy_circuit_state", "Circuit breaker state per upstream host", ("host",)))
+SESSION_WRITEBACKS = registry.register(Counter(
+    "proxy_session_writebacks_total", "Stored sessions updated with rotated cookies",
+    ("host",)))
+SINGLE_FLIGHT_LEADERS = registry.register(Counter(
+    "proxy_single_flight_leaders_total", "Coalescable upstream calls actually started"))
+SINGLE_FLIGHT_COLLAPSED = registry.register(Counter(
+    "proxy_single_flight_collapsed_total", "Requests served by another caller's in-flight call"))
+CACHE_HITS = registry.register(Counter(
+    "proxy_cache_hits_total", "Lookups answered by an in-process cache", ("cache",)))
+CACHE_MISSES = registry.register(Counter(
+    "proxy_cache_misses_total", "Lookups that missed an in-process cache", ("cache",)))
+CACHE_ENTRIES = registry.register(Gauge(
+    "proxy_cache_entries", "Entries held by an in-process cache", ("cache",)))
+RESPONSE_CACHE_REVALIDATIONS = registry.register(Counter(
+    "proxy_response_cache_revalidations_total", "Stale cached responses renewed by a conditional request"))
+RESPONSE_CACHE_BYTES = registry.register(Gauge(
+    "proxy_response_cache_bytes", "Body bytes held by the response cache"))
+RATE_LIMIT_RPS = registry.register(Gauge(
+    "proxy_rate_limit_rps", "Request rate currently allowed per upstream host", ("host",)))
+RATE_LIMIT_THROTTLED = registry.register(Counter(
+    "proxy_rate_limit_throttled_total", "429 responses received per upstream host", ("host",)))
+RATE_LIMIT_QUEUED = registry.register(Counter(
+    "proxy_rate_limit_queued_total", "Requests delayed by the rate limit", ("host",)))
+RATE_LIMIT_BLOCKED = registry.register(Gauge(
+    "proxy_rate_limit_blocked_seconds", "Time left in the pause after a 429", ("host",)))
+
+
+class HostLabels:
+    """Caps the host label values, so arbitrary request URLs cannot grow the registry.
+
+    Hosts, netlocs and URLs are reduced to the lowercase hostname without
+    "www.", so every series spells an upstream the same way and no
+    credentials or ports reach /metrics. The first `limit` distinct hosts
+    keep their name, any later one is labelled "other".
+    """
+
+    def __init__(self, limit: int = config.METRICS_MAX_HOSTS):
+        self.limit = limit
+        self.known: set = set()
+
+    @staticmethod
+    def normalize(host: str) -> str:
+        host = (host or "").strip()
+        try:
+            hostname = urlsplit(host if "://" in host else "//" + host).hostname
+        except ValueError:
+            hostname = None
+        return (hostname or "unknown").removeprefix("www.")
+
+    def __call__(self, host: str) -> str:
+        host = self.normalize(host)
+        if host in self.known:
+            return host
+        if len(self.known) < self.limit:
+            self.known.add(host)
+            return host
+        return "other"
+
+
+host_label = HostLabels()
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Record one stage of a request, also as a span when the request is profiled"""
+    STAGE_LATENCY.observe(seconds, stage=name)
+    record_span(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of a request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Time every call of a coroutine function as one stage of a request"""
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class UpstreamTrace:
+    """httpcore trace callback that records connect time and time to first byte.
+
+    Pass as the "trace" extension of an upstream request; reused keep-alive
+    connections only report TTFB.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_started: Optional[float] = None
+        self.connect_elapsed: Optional[float] = None
+
+    async def __call__(self, event: str, info: Dict) -> None:
+        if event == "connection.connect_tcp.started":
+            self.connect_started = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            # TLS completes after TCP, so the handshake ends up included
+            if self.connect_started is not None:
+                self.connect_elapsed = time.perf_counter() - self.connect_started
+        elif event.endswith(".receive_response_headers.complete"):
+            observe_stage("upstream_ttfb", time.perf_counter() - self.started)
+            if self.connect_elapsed is not None:
+                observe_stage("upstream_connect", self.connect_elapsed)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that counts and times calls to the instrumented endpoints.
+
+    Endpoints label the call with their host by setting request.state.metrics_host,
+    calls that do not are labelled "unknown".
+    """
+
+    def __init__(self, app, endpoints: Sequence[str]):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        scope.setdefault("state", {})
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None)
+            if endpoint in self.endpoints:
+                REQUESTS.inc(
+                    endpoint=endpoint,
+                    host=scope["state"].get("metrics_host", "unknown"),
+                    method=scope["method"],
+                    status=status)
+                REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import config
+
+# opt-in profiling of the proxy's request path, per worker process
+#
+#   Server-Timing   every stage timed by metrics.stage() is also recorded as a
+#                   span of the current request and sent back in the header
+#   slow requests   the PROXY_PROFILING_SLOW_REQUESTS slowest requests of the
+#                   last PROXY_PROFILING_SLOW_WINDOW seconds, with their spans
+#   profiler        statistical sampler of the event loop thread, started and
+#                   stopped on a running proxy, output in collapsed-stack format
+#
+#   curl -X POST 'localhost:8000/debug/profiling?enabled=true'
+#   curl -X POST 'localhost:8000/debug/profiler/start?duration=30'
+#   curl localhost:8000/debug/profiler > proxy.folded   # flamegraph.pl, speedscope
+#   curl localhost:8000/debug/slow-requests
+#
+# Header values and query parameters that look like credentials are redacted
+# before a request is kept, session cookies never reach the slow request log.
+
+# spans of the request being handled, None while profiling is off
+SPANS: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("spans", default=None)
+
+REDACTED = "[redacted]"
+_SENSITIVE = ("auth", "cookie", "token", "secret", "session", "csrf", "password", "code", "key", "sig")
+
+enabled = config.PROFILING
+
+
+def enable(on: bool) -> None:
+    global enabled
+    enabled = on
+
+
+def record_span(name: str, seconds: float) -> None:
+    spans = SPANS.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def is_sensitive(name: str) -> bool:
+    name = name.lower()
+    return any(marker in name for marker in _SENSITIVE)
+
+
+def redact_url(url: str) -> str:
+    """url with its password and credential-like query values replaced"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return REDACTED
+    netloc = parts.netloc
+    if "@" in netloc:
+        netloc = REDACTED + "@" + netloc.rpartition("@")[2]
+    query = urlencode([(name, REDACTED if is_sensitive(name) else value)
+                       for name, value in parse_qsl(parts.query, keep_blank_values=True)])
+    return urlunsplit((parts.scheme, netloc, parts.path, query, ""))
+
+
+def redact_query(query_string: bytes) -> Dict[str, str]:
+    params = {}
+    for name, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+        if is_sensitive(name):
+            value = REDACTED
+        elif name == "url":
+            value = redact_url(value)
+        params[name] = value
+    return params
+
+
+def redact_headers(headers: Sequence[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    redacted = {}
+    for name, value in headers:
+        name = name.decode("latin-1")
+        redacted[name] = REDACTED if is_sensitive(name) else value.decode("latin-1")
+    return redacted
+
+
+def server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing value, repeated stages (retries, batch items) summed under one name"""
+    stages: Dict[str, List[float]] = {}
+    for name, seconds in spans:
+        entry = stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    entries = [f'{name};desc="{count}x";dur={seconds * 1000:.3f}' if count > 1
+               else f"{name};dur={seconds * 1000:.3f}"
+               for name, (seconds, count) in stages.items()]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class SlowRequestLog:
+    """The slowest requests of a recent time window, slowest first.
+
+    A min-heap of at most `size` entries keyed on duration, so a request
+    that is not among the slowest costs one comparison; entries older than
+    `window` seconds are dropped, at most once a second.
+    """
+
+    def __init__(self, size: int = config.PROFILING_SLOW_REQUESTS,
+                 window: float = config.PROFILING_SLOW_WINDOW):
+        self.size = size
+        self.window = window
+        self.heap: List[Tuple[float, int, float, Dict]] = []
+        self.sequence = itertools.count()
+        self.expired_at = 0.0
+
+    def _expire(self, now: float) -> None:
+        if now - self.expired_at < 1.0:
+            return
+        self.expired_at = now
+        live = [entry for entry in self.heap if now - entry[2] < self.window]
+        if len(live) != len(self.heap):
+            heapq.heapify(live)
+            self.heap = live
+
+    def offer(self, duration: float, build: Callable[[], Dict]) -> None:
+        """Keep a request if it is among the slowest, build() is only called then"""
+        now = time.time()
+        self._expire(now)
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (duration, next(self.sequence), now, build()))
+        elif duration > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (duration, next(self.sequence), now, build()))
+
+    def snapshot(self) -> List[Dict]:
+        self.expired_at = 0.0
+        self._expire(time.time())
+        return [record for _, _, _, record in sorted(self.heap, reverse=True)]
+
+    def clear(self) -> None:
+        self.heap = []
+
+
+class SamplingProfiler:
+    """Statistical profiler of one thread, meant for the event loop.
+
+    A daemon thread reads the target thread's stack every `interval` seconds
+    through sys._current_frames() and counts identical stacks; nothing is
+    hooked into the profiled code, so it can be started on a live proxy.
+    """
+
+    def __init__(self, interval: float = config.PROFILER_INTERVAL, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval: Optional[float] = None, duration: Optional[float] = None,
+              thread_id: Optional[int] = None) -> bool:
+        """Start sampling thread_id (the calling thread by default), False if already running"""
+        if self.running:
+            return False
+        if interval:
+            self.interval = interval
+        with self.lock:
+            self.counts = {}
+            self.samples = 0
+        self.started_at = time.time()
+        self.stop_event.clear()
+        deadline = time.monotonic() + duration if duration else None
+        self.thread = threading.Thread(
+            target=self._run, args=(thread_id or threading.get_ident(), deadline),
+            name="proxy-profiler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def _stack(self, frame) -> str:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self, thread_id: int, deadline: Optional[float]) -> None:
+        while not self.stop_event.wait(self.interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            stack = self._stack(frame)
+            del frame
+            with self.lock:
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        """Sampled stacks as "outer;...;inner count" lines, most frequent first"""
+        with self.lock:
+            counts = sorted(self.counts.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in counts)
+
+    def status(self) -> Dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "started_at": self.started_at
+        }
+
+
+slow_requests = SlowRequestLog()
+profiler = SamplingProfiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that collects the spans of calls to the instrumented endpoints.
+
+    Adds a Server-Timing header to their responses and offers each finished
+    call to the slow request log. Costs one flag check while profiling is off.
+    """
+
+    def __init__(self, app, endpoints: Sequence[str]):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            return await self.app(scope, receive, send)
+
+        spans: List[Tuple[str, float]] = []
+        reset = SPANS.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if getattr(scope.get("route"), "path", None) in self.endpoints:
+                    timing = server_timing(spans, time.perf_counter() - start)
+                    message = {**message, "headers": [
+                        *message.get("headers", []), (b"server-timing", timing.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            SPANS.reset(reset)
+            endpoint = getattr(scope.get("route"), "path", None)
+            if endpoint in self.endpoints:
+                duration = time.perf_counter() - start
+                slow_requests.offer(duration, lambda: {
+                    "ts": round(time.time(), 3),
+                    "endpoint": endpoint,
+                    "method": scope["method"],
+                    "host": scope.get("state", {}).get("metrics_host", ""),
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 3),
+                    "spans": [{"stage": name, "ms": round(seconds * 1000, 3)}
+                              for name, seconds in spans],
+                    "query": redact_query(scope.get("query_string", b"")),
+                    "headers": redact_headers(scope.get("headers", []))
+                })
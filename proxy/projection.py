@@ -0,0 +1,111 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# server-side projection of upstream JSON bodies, so only what a tool keeps
+# crosses the proxy -> client link
+#
+#   select   dotted path with [*] for every element of an array
+#              select=data.user.result.rest_id        -> "44196397"
+#              select=result[*]                       -> [{...}, {...}]
+#   fields   comma-separated fields kept from each selected value, as
+#            path or name=path, with | between fallback paths
+#              fields=id,subject
+#              fields=id=rest_id,text=note_tweet.note_tweet_results.result.text|legacy.full_text
+#
+# a select without [*] gives one value (null when missing), one with [*]
+# gives the list of every match; in field paths a number indexes an array
+# (fields=first=items.0.id)
+#
+# parse_path and _get are the same as in client/stream_extract.py, so a
+# tool's paths and fields mean the same on either side of the proxy
+
+_PATH_PART = re.compile(r'([^\[\]]*)((?:\[\*\])*)')
+_FIELD_NAME = re.compile(r'[A-Za-z0-9_\-]+')
+
+
+def parse_path(path: str) -> List[str]:
+    """Split "a.b[*].c" into ['a', 'b', '*', 'c']"""
+    parts = []
+    for part in path.split(".") if path else ():
+        match = _PATH_PART.fullmatch(part)
+        if match is None or not (match.group(1) or match.group(2)):
+            raise ValueError(f"Unsupported path segment {part!r}, use key or key[*]")
+        name, stars = match.groups()
+        if name:
+            parts.append(name)
+        parts.extend("*" * (len(stars) // 3))
+    return parts
+
+
+def _select(obj: Any, parts: List[str]):
+    if not parts:
+        yield obj
+        return
+    head, rest = parts[0], parts[1:]
+    if head == "*":
+        children = obj if isinstance(obj, list) else obj.values() if isinstance(obj, dict) else ()
+    elif isinstance(obj, dict) and head in obj:
+        children = (obj[head],)
+    else:
+        children = ()
+    for child in children:
+        yield from _select(child, rest)
+
+
+def _get(obj: Any, parts: List[str]) -> Any:
+    for part in parts:
+        if isinstance(obj, dict):
+            obj = obj.get(part)
+        elif isinstance(obj, list) and part.isdigit() and int(part) < len(obj):
+            obj = obj[int(part)]
+        else:
+            return None
+        if obj is None:
+            return None
+    return obj
+
+
+class Projection:
+    """A parsed select/fields pair, applied to decoded upstream JSON"""
+
+    def __init__(self, select: Optional[str] = None, fields: Optional[str] = None):
+        self.select = parse_path(select) if select else []
+        self.many = "*" in self.select
+        self.fields: Optional[List[Tuple[str, List[List[str]]]]] = None
+        if fields:
+            self.fields = []
+            for field in fields.split(","):
+                name, _, paths = field.strip().rpartition("=")
+                alternatives = [parse_path(path.strip()) for path in paths.split("|")]
+                if "*" in (part for path in alternatives for part in path):
+                    raise ValueError(f"Field {field!r} cannot contain [*]")
+                name = name.strip() or (alternatives[0][-1] if alternatives[0] else "")
+                if not _FIELD_NAME.fullmatch(name):
+                    raise ValueError(f"Invalid field {field!r}")
+                self.fields.append((name, alternatives))
+
+    def _pick(self, item: Any) -> Dict[str, Any]:
+        picked = {}
+        for name, alternatives in self.fields:
+            value = None
+            for path in alternatives:
+                value = _get(item, path)
+                if value is not None:
+                    break
+            picked[name] = value
+        return picked
+
+    def apply(self, document: Any) -> Any:
+        matches = _select(document, self.select)
+        if self.fields is not None:
+            matches = (self._pick(item) for item in matches)
+        if self.many:
+            return list(matches)
+        return next(matches, None)
+
+
+def make_projection(select: Optional[str], fields: Optional[str]) -> Optional[Projection]:
+    """The projection for a request's select and fields, None when neither is given"""
+    if not select and not fields:
+        return None
+    return Projection(select, fields)
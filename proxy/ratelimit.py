@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httpx
+
+from capture_config import default_rate_limit, rate_limits
+
+# sessions tracked per host before the least recently used bucket is dropped
+MAX_SESSION_BUCKETS = 1024
+# hosts tracked before the least recently used idle one is dropped
+MAX_HOSTS = 1024
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given as seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of rejecting.
+
+    Tokens may go negative, each reservation returns how long the caller
+    has to wait for its turn, so excess requests queue in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float) -> None:
+        # settle the tokens earned at the old rate before switching
+        self._refill()
+        self.rate = rate
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class HostLimiter:
+    """Rate and concurrency limits for one upstream host.
+
+    The host bucket rate is cut in half on every 429 and recovers a tenth
+    of the configured rate per successful response, while Retry-After (or
+    an exponential pause when it is missing) holds all new requests back.
+    """
+
+    def __init__(self, limits: Dict):
+        self.limits = limits
+        self.bucket = TokenBucket(limits['host_rps'], limits['host_burst'])
+        self.sessions: OrderedDict = OrderedDict()
+        self.semaphore = asyncio.Semaphore(limits['max_concurrency'])
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        self.throttled = 0
+        self.queued = 0
+        # requests waiting for or holding a slot
+        self.pending = 0
+
+    def idle(self) -> bool:
+        """Whether dropping this limiter loses nothing but its refill state"""
+        return self.pending == 0 and self.blocked_until <= time.monotonic()
+
+    def _session_bucket(self, session_id: str) -> TokenBucket:
+        bucket = self.sessions.get(session_id)
+        if bucket is None:
+            bucket = TokenBucket(
+                self.limits['session_rps'], self.limits['session_burst'])
+            self.sessions[session_id] = bucket
+            while len(self.sessions) > MAX_SESSION_BUCKETS:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session_id)
+        return bucket
+
+    def delay(self, session_id: str) -> float:
+        wait = max(self.bucket.reserve(),
+                   self._session_bucket(session_id).reserve())
+        return max(wait, self.blocked_until - time.monotonic())
+
+    def observe(self, response: httpx.Response) -> None:
+        configured = self.limits['host_rps']
+        if response.status_code == 429:
+            self.throttled += 1
+            self.consecutive_throttles += 1
+            self.bucket.set_rate(max(self.bucket.rate / 2, configured / 20))
+            pause = parse_retry_after(response.headers.get('retry-after'))
+            if pause is None:
+                pause = 2 ** min(self.consecutive_throttles, 6)
+            pause = min(pause, self.limits['max_backoff'])
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+        else:
+            self.consecutive_throttles = 0
+            if self.bucket.rate < configured:
+                self.bucket.set_rate(min(configured, self.bucket.rate + configured / 10))
+
+
+class RateLimiter:
+    """Per-host and per-session limits for upstream traffic, configured in capture_config"""
+
+    def __init__(self, limits: Dict[str, Dict] = rate_limits, default: Dict = default_rate_limit):
+        self.limits = {self._normalize(host): {**default, **host_limits}
+                       for host, host_limits in limits.items()}
+        self.default = default
+        self.hosts: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _normalize(host: str) -> str:
+        return (host or "").lower().removeprefix('www.')
+
+    def host(self, host: str) -> HostLimiter:
+        host = self._normalize(host)
+        limiter = self.hosts.get(host)
+        if limiter is None:
+            limiter = HostLimiter(self.limits.get(host, self.default))
+            self.hosts[host] = limiter
+            self._evict()
+        else:
+            self.hosts.move_to_end(host)
+        return limiter
+
+    def _evict(self) -> None:
+        # a paused host or one with requests in flight keeps its limiter
+        for host in list(self.hosts):
+            if len(self.hosts) <= MAX_HOSTS:
+                break
+            if self.hosts[host].idle():
+                del self.hosts[host]
+
+    def blocked(self, host: str) -> bool:
+        """Whether host is paused by a recent 429"""
+        limiter = self.hosts.get(self._normalize(host))
+        return limiter is not None and limiter.blocked_until > time.monotonic()
+
+    @asynccontextmanager
+    async def acquire(self, host: str, session_id: str):
+        """Wait for a rate slot and a concurrency slot on host, then hold the latter"""
+        limiter = self.host(host)
+        limiter.pending += 1
+        try:
+            wait = limiter.delay(session_id)
+            if wait > 0:
+                limiter.queued += 1
+                await asyncio.sleep(wait)
+            async with limiter.semaphore:
+                yield limiter
+        finally:
+            limiter.pending -= 1
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            host: {
+                "rate": limiter.bucket.rate,
+                "throttled": limiter.throttled,
+                "queued": limiter.queued,
+                "blocked_for": max(limiter.blocked_until - time.monotonic(), 0.0)
+            }
+            for host, limiter in self.hosts.items()
+        }
@@ -0,0 +1,337 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+import config
+import metrics
+from ratelimit import parse_retry_after
+
+# retried when the method is idempotent, and counted against the circuit breaker
+RETRYABLE_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# network failures worth another attempt; the rest of httpx.TransportError
+# (unsupported scheme, malformed request, proxy setup) fails the same way again
+RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+# only these are hedged, a duplicate PUT or DELETE in flight is not harmless
+HEDGED_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# p95 is recomputed after this many new latency samples rather than on every request
+P95_REFRESH = 16
+# hosts tracked before the least recently used healthy, idle one is dropped
+MAX_HOSTS = 1024
+
+# sends one attempt; calls admit() once the attempt holds its rate-limit and
+# concurrency slot, so local queueing is kept out of latency and hedge timing
+Send = Callable[[httpx.Request, Callable[[], None]], Awaitable[httpx.Response]]
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit open for {host}, retry in {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """Sliding window of recent upstream latencies for one host"""
+
+    def __init__(self, size: int = 256):
+        self.samples: deque = deque(maxlen=size)
+        self.p95: Optional[float] = None
+        self.pending = 0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.pending += 1
+        if self.pending >= P95_REFRESH or self.p95 is None:
+            ordered = sorted(self.samples)
+            self.p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self.pending = 0
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker.
+
+    After `threshold` failures in a row the circuit opens and requests fail
+    fast for `reset_timeout` seconds; then a single probe is let through,
+    closing the circuit on success and reopening it on failure.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.probing = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # an attempt was abandoned (a losing hedge) without an outcome
+        self.probing = False
+
+
+class HostHealth:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.breaker = CircuitBreaker(threshold, reset_timeout)
+        self.latency = LatencyWindow()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        # requests being sent, with their retries and hedges
+        self.pending = 0
+
+    def idle(self) -> bool:
+        """Whether dropping this host loses nothing but its latency history"""
+        return self.pending == 0 and self.breaker.state == "closed"
+
+
+def _clone(request: httpx.Request) -> httpx.Request:
+    """A fresh copy of a buffered request, safe to send alongside the original"""
+    return httpx.Request(
+        request.method,
+        request.url,
+        headers=request.headers,
+        content=request.content,
+        extensions={k: v for k, v in request.extensions.items() if k != "trace"}
+    )
+
+
+def _discard(task: asyncio.Task) -> None:
+    """Cancel a losing attempt and close its response if it finished anyway"""
+    def close(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(task.result().aclose())
+    task.cancel()
+    task.add_done_callback(close)
+
+
+class Resilience:
+    """Retries, hedging and circuit breaking for upstream requests, per host.
+
+    Idempotent requests that fail with a network error or a 502/503/504
+    are retried with full-jitter exponential backoff (honouring Retry-After).
+    Safe requests still waiting after the host's p95 latency get a second,
+    hedged attempt and the first good response wins; no hedge is sent while
+    `throttled(host)` says the host is holding requests back.
+    """
+
+    def __init__(
+        self,
+        retries: int = config.UPSTREAM_RETRIES,
+        backoff: float = config.UPSTREAM_RETRY_BACKOFF,
+        max_backoff: float = config.UPSTREAM_RETRY_MAX_BACKOFF,
+        hedge: bool = config.UPSTREAM_HEDGE,
+        hedge_min_delay: float = config.UPSTREAM_HEDGE_MIN_DELAY,
+        hedge_min_samples: int = config.UPSTREAM_HEDGE_MIN_SAMPLES,
+        breaker_threshold: int = config.BREAKER_FAILURE_THRESHOLD,
+        breaker_reset_timeout: float = config.BREAKER_RESET_TIMEOUT,
+        throttled: Optional[Callable[[str], bool]] = None
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.throttled = throttled or (lambda host: False)
+        self.hosts: OrderedDict = OrderedDict()
+
+    def host(self, host: str) -> HostHealth:
+        host = (host or "").lower().removeprefix("www.")
+        health = self.hosts.get(host)
+        if health is None:
+            health = HostHealth(self.breaker_threshold, self.breaker_reset_timeout)
+            self.hosts[host] = health
+            self._evict()
+        else:
+            self.hosts.move_to_end(host)
+        return health
+
+    def _evict(self) -> None:
+        # an open or half-open circuit, or a host with requests in flight, is kept
+        for host in list(self.hosts):
+            if len(self.hosts) <= MAX_HOSTS:
+                break
+            if self.hosts[host].idle():
+                del self.hosts[host]
+
+    def _hedge_delay(self, health: HostHealth) -> Optional[float]:
+        if health.latency.p95 is None or len(health.latency.samples) < self.hedge_min_samples:
+            return None
+        return max(health.latency.p95, self.hedge_min_delay)
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = parse_retry_after(
+            response.headers.get("retry-after")) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _timed(self, health: HostHealth, request: httpx.Request, send: Send,
+                     admitted: asyncio.Event) -> httpx.Response:
+        start = time.perf_counter()
+
+        def admit() -> None:
+            nonlocal start
+            start = time.perf_counter()
+            admitted.set()
+
+        try:
+            response = await send(request, admit)
+        except asyncio.CancelledError:
+            health.breaker.release()
+            raise
+        except RETRYABLE_ERRORS:
+            health.breaker.record_failure()
+            raise
+        except httpx.TransportError:
+            # says nothing about the host's health
+            health.breaker.release()
+            raise
+        if response.status_code in RETRYABLE_STATUSES:
+            health.breaker.record_failure()
+        else:
+            health.breaker.record_success()
+            health.latency.observe(time.perf_counter() - start)
+        return response
+
+    async def _attempt(self, host: str, health: HostHealth, request: httpx.Request,
+                       send: Send) -> httpx.Response:
+        """One attempt, raced against a hedged copy once it outlives the host's p95"""
+        delay = self._hedge_delay(health) if self.hedge and request.method in HEDGED_METHODS else None
+        first_admitted = asyncio.Event()
+        first = asyncio.ensure_future(self._timed(health, request, send, first_admitted))
+        if delay is None:
+            return await first
+
+        pending = {first}
+        admitted = asyncio.ensure_future(first_admitted.wait())
+        try:
+            # the hedge clock starts once the first attempt holds its rate-limit slot
+            await asyncio.wait({first, admitted}, return_when=asyncio.FIRST_COMPLETED)
+            if not first.done():
+                await asyncio.wait({first}, timeout=delay)
+            # a throttled host gets no duplicate, it would only take another queued slot
+            if first.done() or self.throttled(host) or not health.breaker.allow():
+                pending = set()
+                return await first
+
+            health.hedges += 1
+            second = asyncio.ensure_future(
+                self._timed(health, _clone(request), send, asyncio.Event()))
+            pending = {first, second}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                good = [task for task in done if task.exception() is None
+                        and task.result().status_code not in RETRYABLE_STATUSES]
+                if good or not pending:
+                    winner = good[0] if good else next(iter(done))
+                    for task in done:
+                        if task is not winner and task.exception() is None:
+                            await task.result().aclose()
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        await task.result().aclose()
+        finally:
+            admitted.cancel()
+            for task in pending:
+                _discard(task)
+
+        won = winner is second and bool(good)
+        if won:
+            health.hedge_wins += 1
+        metrics.UPSTREAM_HEDGES.inc(host=metrics.host_label(host), outcome="won" if won else "lost")
+        response = winner.result()
+        response.extensions["upstream_hedged"] = True
+        return response
+
+    async def send(self, request: httpx.Request, send: Send) -> httpx.Response:
+        """Send through the host's circuit breaker with retries and hedging.
+
+        Raises CircuitOpenError when the host is failing fast; the response
+        carries the attempt count in extensions["upstream_attempts"].
+        """
+        host = (request.url.host or "").lower().removeprefix("www.")
+        health = self.host(host)
+        health.pending += 1
+        try:
+            return await self._send(host, health, request, send)
+        finally:
+            health.pending -= 1
+
+    async def _send(self, host: str, health: HostHealth, request: httpx.Request, send: Send) -> httpx.Response:
+        attempts = self.retries + 1 if request.method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if not health.breaker.allow():
+                health.rejected += 1
+                metrics.CIRCUIT_REJECTIONS.inc(host=metrics.host_label(host))
+                raise CircuitOpenError(host, health.breaker.retry_after())
+            if attempt:
+                health.retries += 1
+                metrics.UPSTREAM_RETRIES.inc(host=metrics.host_label(host))
+
+            response = None
+            try:
+                response = await self._attempt(
+                    host, health, request if attempt == 0 else _clone(request), send)
+            except RETRYABLE_ERRORS:
+                if attempt == attempts - 1 or health.breaker.state == "open":
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUSES \
+                        or attempt == attempts - 1 or health.breaker.state == "open":
+                    response.extensions["upstream_attempts"] = attempt + 1
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            host: {
+                "state": health.breaker.state,
+                "opened": health.breaker.opened,
+                "p95": health.latency.p95,
+                "retries": health.retries,
+                "hedges": health.hedges,
+                "hedge_wins": health.hedge_wins,
+                "rejected": health.rejected
+            }
+            for host, health in self.hosts.items()
+        }
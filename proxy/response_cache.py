@@ -0,0 +1,146 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+import config
+
+# headers that describe the wire encoding rather than the cached body
+UNCACHED_HEADERS = {"content-encoding", "content-length",
+                    "transfer-encoding", "connection", "set-cookie"}
+
+
+def session_identity(session: Dict) -> str:
+    """Stable digest of a session's cookies and headers, used to partition cache entries"""
+    raw = json.dumps([session["cookies"], session["headers"]], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+class ResponseCache:
+    """Memory-bounded LRU of upstream GET responses, partitioned per session.
+
+    Freshness comes from the per-host TTL override when one is configured,
+    otherwise from the upstream Cache-Control max-age. Stale entries that
+    carry an ETag or Last-Modified are revalidated with a conditional
+    request instead of being fetched again.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = config.RESPONSE_CACHE_MAX_BYTES,
+        max_entry_bytes: int = config.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+        host_ttl: Dict[str, float] = config.RESPONSE_CACHE_HOST_TTL
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.host_ttl = host_ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def _freshness(self, host: str, response: httpx.Response) -> Optional[float]:
+        """Seconds a response may be served without revalidation, None if it must not be stored"""
+        if host in self.host_ttl:
+            return self.host_ttl[host]
+        directives = parse_cache_control(response.headers.get("cache-control", ""))
+        if "no-store" in directives:
+            return None
+        if "no-cache" not in directives and directives.get("max-age"):
+            try:
+                return max(float(directives["max-age"]), 0.0)
+            except ValueError:
+                pass
+        if "etag" in response.headers or "last-modified" in response.headers:
+            return 0.0
+        return None
+
+    def _replay(self, entry: Dict, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            entry["status"],
+            headers=entry["headers"],
+            content=entry["body"],
+            request=request
+        )
+
+    def _evict(self, key) -> None:
+        entry = self.entries.pop(key)
+        self.size -= len(entry["body"])
+
+    def _store(self, key, host: str, response: httpx.Response) -> None:
+        if key in self.entries:
+            self._evict(key)
+        if response.status_code != 200:
+            return
+        freshness = self._freshness(host, response)
+        body = response.content
+        if freshness is None or len(body) > self.max_entry_bytes:
+            return
+
+        while self.entries and self.size + len(body) > self.max_bytes:
+            self._evict(next(iter(self.entries)))
+        self.entries[key] = {
+            "status": response.status_code,
+            "headers": [(k, v) for k, v in response.headers.multi_items()
+                        if k.lower() not in UNCACHED_HEADERS],
+            "body": body,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "fresh_until": time.monotonic() + freshness
+        }
+        self.size += len(body)
+
+    async def send(
+        self,
+        request: httpx.Request,
+        session_id: str,
+        send: Callable[[httpx.Request], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """Send a GET through the cache, returning a stored, revalidated or fresh response"""
+        host = (request.url.host or "").lower().removeprefix("www.")
+        key = (host, session_id, request.method, str(request.url))
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if time.monotonic() < entry["fresh_until"]:
+                self.hits += 1
+                return self._replay(entry, request)
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = await send(request)
+
+        if entry is not None and response.status_code == 304:
+            self.revalidated += 1
+            freshness = self._freshness(host, response)
+            entry["fresh_until"] = time.monotonic() + (freshness or 0.0)
+            return self._replay(entry, request)
+
+        self.misses += 1
+        self._store(key, host, response)
+        return response
+
+    def cache_info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
@@ -1,23 +1,18 @@
 from mitmproxy import ctx, http
+import copy
 import json
-import pickle
 from datetime import datetime
 import os
+import tempfile
+import threading
+import time
 from pathlib import Path
 
-# add global list of hosts to capture
-hosts_to_capture = ["www.linkedin.com", "x.com"]
+from capture_config import capture_rules
+from session_db import SessionDatabase
 
-# global dict of cookies and headers to capture per host
-cookies_to_capture = {
-    'www.linkedin.com': ['li_at', 'JSESSIONID', 'bcookie'],
-    'x.com': ['auth_token', 'ct0', 'twid', 'guest_id']
-}
-
-headers_to_capture = {
-    'www.linkedin.com': ['csrf-token', 'user-agent'],
-    'x.com': ['x-csrf-token', 'x-twitter-client-language', 'authorization', 'user-agent']
-}
+# seconds to wait after a change before writing, so a burst of requests is saved once
+SAVE_DEBOUNCE = 1.0
 
 
 class SessionCapturer:
@@ -25,56 +20,103 @@ class SessionCapturer:
         self.sessions = {}
         self.save_dir = Path("captured_sessions")
         self.save_dir.mkdir(exist_ok=True)
+        self.db = SessionDatabase()
+
+        # hosts whose cookies or headers changed since the last write
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
 
     def request(self, flow: http.HTTPFlow) -> None:
         """Process each request to capture session data"""
-        host = flow.request.pretty_host
-        if host not in hosts_to_capture:
+        rule = capture_rules.match(flow.request.pretty_host)
+        if rule is None:
             return
-
-        if host not in self.sessions:
-            self.sessions[host] = {
-                'cookies': {},
-                'headers': {},
-                'timestamp': datetime.now().isoformat(),
-                'host': host
-            }
-
-        # Capture cookies from requests
-        for cookie in flow.request.cookies.fields:
-            name, value = cookie
-            # Decode bytes to strings and store as simple key-value pairs
-            cookie_name = name.decode(
-                'utf-8', 'ignore') if isinstance(name, bytes) else str(name)
-            cookie_value = value.decode(
-                'utf-8', 'ignore') if isinstance(value, bytes) else str(value)
-            if cookie_name in cookies_to_capture[host]:
-                self.sessions[host]['cookies'][cookie_name] = cookie_value
-
-        # Capture important headers
-        for header, value in flow.request.headers.items():
-            if header in headers_to_capture[host]:
-                self.sessions[host]['headers'][header] = value
-
-        self.save_session(host)
-
-    def save_session(self, host: str) -> None:
+        # subdomains matched by one rule all feed the same session
+        host = rule.domain
+
+        changed = False
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = {
+                    'cookies': {},
+                    'headers': {},
+                    'timestamp': datetime.now().isoformat(),
+                    'host': host
+                }
+            session = self.sessions[host]
+
+            # Capture cookies from requests
+            for cookie in flow.request.cookies.fields:
+                name, value = cookie
+                # Decode bytes to strings and store as simple key-value pairs
+                cookie_name = name.decode(
+                    'utf-8', 'ignore') if isinstance(name, bytes) else str(name)
+                cookie_value = value.decode(
+                    'utf-8', 'ignore') if isinstance(value, bytes) else str(value)
+                if cookie_name.lower() in rule.cookies and session['cookies'].get(cookie_name) != cookie_value:
+                    session['cookies'][cookie_name] = cookie_value
+                    changed = True
+
+            # Capture important headers
+            for header, value in flow.request.headers.items():
+                header = header.lower()
+                if header in rule.headers and session['headers'].get(header) != value:
+                    session['headers'][header] = value
+                    changed = True
+
+            if changed:
+                self.dirty.add(host)
+
+        if changed:
+            self.wakeup.set()
+
+    def _write_loop(self) -> None:
+        """Background writer, coalesces changes and saves them off the flow handler"""
+        while not self.stopping:
+            self.wakeup.wait()
+            if not self.stopping:
+                time.sleep(SAVE_DEBOUNCE)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                ctx.log.error(f"Failed to save sessions: {e}")
+
+    def flush(self) -> None:
+        """Write every dirty session now"""
+        with self.lock:
+            hosts, self.dirty = self.dirty, set()
+            snapshot = {host: copy.deepcopy(self.sessions[host]) for host in hosts}
+        if snapshot:
+            self.save_sessions(snapshot)
+
+    def done(self) -> None:
+        """mitmproxy shutdown hook, stop the writer and save what is left"""
+        self.stopping = True
+        self.wakeup.set()
+        self.writer.join()
+        self.flush()
+
+    def save_sessions(self, sessions: dict) -> None:
         """Save the captured session data"""
-        if host not in self.sessions:
-            return
-
-        # Create a clean filename from the host
-        filename = host.replace('.', '_').replace(':', '_')
-
-        # Save as JSON for human readability
-        json_path = self.save_dir / f"{filename}.json"
-        with open(json_path, 'w') as f:
-            json.dump(self.sessions[host], f, indent=2)
-
-        # Save as pickle for complete object serialization
-        pkl_path = self.save_dir / f"{filename}.pkl"
-        with open(pkl_path, 'wb') as f:
-            pickle.dump(self.sessions[host], f)
+        for host, session in sessions.items():
+            # Create a clean filename from the host
+            filename = host.replace('.', '_').replace(':', '_')
+
+            # Save as JSON for human readability, through a temp file and
+            # rename so a reader never sees a half-written file
+            json_path = self.save_dir / f"{filename}.json"
+            fd, tmp_path = tempfile.mkstemp(dir=self.save_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(session, f, indent=2)
+            os.replace(tmp_path, json_path)
+
+        # Save to the session database the proxy reads from, in one transaction
+        self.db.put_many(sessions)
 
 
 addons = [SessionCapturer()]
@@ -0,0 +1,198 @@
+import json
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+# captured sessions in one SQLite file, indexed by normalized host
+#
+#   python session_db.py import output.json           bulk import from the Chrome extension
+#   python session_db.py migrate captured_sessions    one-time move off the old .pkl files
+
+
+def normalize_host(host: str) -> str:
+    return host.lower().removeprefix('www.').removeprefix('www_')
+
+
+def session_key(host: str) -> str:
+    """Index key for a host, "www.x.com", "x.com" and "x_com" all map to "x_com" """
+    return normalize_host(host).replace('.', '_').replace(':', '_')
+
+
+def apply_cookies(cookies: Dict[str, str], changes: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """A copy of a cookie jar with changes applied, None deletes a cookie"""
+    merged = dict(cookies)
+    for name, value in changes.items():
+        if value is None:
+            merged.pop(name, None)
+        else:
+            merged[name] = value
+    return merged
+
+
+class _SessionUnpickler(pickle.Unpickler):
+    # legacy session pickles only ever hold dicts, lists and strings
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name}")
+
+
+class SessionDatabase:
+    """Single-file session store with atomic per-host updates.
+
+    The database runs in WAL mode so the proxy can read while the session
+    capturer writes. data_version() changes whenever another connection
+    commits, which lets readers keep an in-memory cache.
+
+    Every write bumps the host's version, returned with the session as
+    session["version"], so a holder of an older copy can tell it is stale.
+
+    Writes go through a connection of their own, so a write that waits out
+    the busy timeout behind another process never holds up readers.
+    """
+
+    def __init__(self, path: str = config.SESSION_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "host TEXT PRIMARY KEY, session TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+        if "version" not in columns:
+            # databases written before sessions were versioned
+            self.conn.execute(
+                "ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.write_lock = threading.Lock()
+        self.write_conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False)
+
+    @staticmethod
+    def _row(conn: sqlite3.Connection, key: str) -> Optional[Tuple[str, int]]:
+        return conn.execute(
+            "SELECT session, version FROM sessions WHERE host = ?", (key,)).fetchone()
+
+    @staticmethod
+    def _load(row: Tuple[str, int]) -> Dict:
+        session = json.loads(row[0])
+        session["version"] = row[1]
+        return session
+
+    @staticmethod
+    def _dump(session: Dict) -> str:
+        return json.dumps({k: v for k, v in session.items() if k != "version"})
+
+    def get(self, host: str) -> Optional[Dict]:
+        with self.lock:
+            row = self._row(self.conn, session_key(host))
+        return self._load(row) if row else None
+
+    def put(self, host: str, session: Dict) -> None:
+        self.put_many({host: session})
+
+    def put_many(self, sessions: Dict[str, Dict]) -> None:
+        """Write several sessions in one transaction"""
+        now = time.time()
+        rows = [(session_key(host), self._dump(session), now)
+                for host, session in sessions.items()]
+        with self.write_lock:
+            with self.write_conn:
+                self.write_conn.execute("BEGIN IMMEDIATE")
+                self.write_conn.executemany(
+                    "INSERT INTO sessions (host, session, updated_at, version) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (host) DO UPDATE SET session = excluded.session, "
+                    "updated_at = excluded.updated_at, version = sessions.version + 1",
+                    rows)
+
+    def merge_cookies(self, host: str, cookies: Dict[str, Optional[str]]) -> Optional[Dict]:
+        """Set (or, for None, delete) cookies of a stored session in one transaction.
+
+        Returns the session as stored afterwards, its version bumped only if
+        a cookie actually changed, or None if the host has no session.
+        """
+        key = session_key(host)
+        with self.write_lock:
+            with self.write_conn:
+                self.write_conn.execute("BEGIN IMMEDIATE")
+                row = self._row(self.write_conn, key)
+                if row is None:
+                    return None
+                session = self._load(row)
+                merged = apply_cookies(session["cookies"], cookies)
+                if merged == session["cookies"]:
+                    return session
+                session["cookies"] = merged
+                session["version"] += 1
+                self.write_conn.execute(
+                    "UPDATE sessions SET session = ?, updated_at = ?, version = ? WHERE host = ?",
+                    (self._dump(session), time.time(), session["version"], key))
+        return session
+
+    def hosts(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT host FROM sessions")]
+
+    def data_version(self) -> int:
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def import_file(self, path: Path, force: bool = False) -> int:
+        """Import the Chrome extension's output.json, skipped if it has not changed since the last import"""
+        stat = path.stat()
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+        meta_key = f"import:{path.resolve()}"
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (meta_key,)).fetchone()
+        if row and row[0] == signature and not force:
+            return 0
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        self.put_many(data)
+        with self.write_lock:
+            self.write_conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (meta_key, signature))
+        return len(data)
+
+    def migrate_dir(self, sessions_dir: Path) -> int:
+        """Import every legacy <host>.pkl from a captured_sessions directory"""
+        sessions = {}
+        for pkl_path in sorted(sessions_dir.glob("*.pkl")):
+            try:
+                with open(pkl_path, "rb") as f:
+                    sessions[pkl_path.stem] = _SessionUnpickler(f).load()
+            except (pickle.UnpicklingError, EOFError) as e:
+                print(f"Skipping {pkl_path}: {e}")
+        self.put_many(sessions)
+        return len(sessions)
+
+    def close(self) -> None:
+        self.conn.close()
+        self.write_conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("import", "migrate"):
+        print("usage: python session_db.py import <output.json> | migrate <captured_sessions>")
+        sys.exit(1)
+
+    db = SessionDatabase()
+    if sys.argv[1] == "import":
+        count = db.import_file(Path(sys.argv[2]), force=True)
+    else:
+        count = db.migrate_dir(Path(sys.argv[2]))
+    print(f"Saved {count} sessions to {db.path}")
@@ -1,23 +1,18 @@
-import json
-import pickle
 import requests
-from pathlib import Path
+
+from session_db import SessionDatabase
 
 
 class SessionLoader:
-    def __init__(self, sessions_dir="captured_sessions"):
-        self.sessions_dir = Path(sessions_dir)
+    def __init__(self, db_path="sessions.db"):
+        self.db = SessionDatabase(db_path)
 
     def load_session(self, host):
         """Load a captured session for a specific host"""
-        filename = host.replace('.', '_').replace(':', '_')
-        pkl_path = self.sessions_dir / f"{filename}.pkl"
-
-        if not pkl_path.exists():
+        session = self.db.get(host)
+        if session is None:
             raise FileNotFoundError(f"No session found for {host}")
-
-        with open(pkl_path, 'rb') as f:
-            return pickle.load(f)
+        return session
 
     def create_requests_session(self, host):
         """Create a requests session with the captured authentication data"""
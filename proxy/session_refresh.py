@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import config
+import metrics
+from capture_config import capture_rules
+from logs import log_event
+from session_db import session_key
+
+# write-back of cookies that upstreams rotate through Set-Cookie (ct0,
+# JSESSIONID, ...), so a stored session keeps working after its first use
+#
+# Only cookies the session already holds, or that the capture rules for the
+# host allow, are written back, and only when their Domain covers the host;
+# trackers and analytics cookies set alongside them are left out.
+#
+# Rotated values are merged into the session store, which bumps the session's
+# version. Tokens that embed a session carry the version they were issued
+# with, and are switched to the stored jar once it has moved past it.
+
+
+def parse_set_cookie(header: str) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    """(name, value, domain) of a Set-Cookie header.
+
+    value is None when the cookie is deleted, domain is None for a
+    host-only cookie and otherwise lowercase without its leading dot.
+    """
+    pair, *attributes = header.split(";")
+    name, sep, value = pair.partition("=")
+    name = name.strip()
+    if not sep or not name:
+        return None
+
+    options = {}
+    for attribute in attributes:
+        key, _, argument = attribute.partition("=")
+        options[key.strip().lower()] = argument.strip()
+    domain = options.get("domain", "").lower().lstrip(".") or None
+    # Max-Age wins over Expires when a cookie has both
+    if "max-age" in options:
+        try:
+            if int(options["max-age"]) <= 0:
+                return name, None, domain
+        except ValueError:
+            pass
+    elif "expires" in options:
+        try:
+            if parsedate_to_datetime(options["expires"]).timestamp() <= time.time():
+                return name, None, domain
+        except (TypeError, ValueError):
+            pass
+    return name, value.strip(), domain
+
+
+def domain_matches(hostname: str, domain: str) -> bool:
+    """Whether a cookie for domain is sent to hostname (RFC 6265 domain-match)"""
+    return hostname == domain or hostname.endswith("." + domain)
+
+
+def rotated_cookies(response: httpx.Response, cookies: Dict[str, str], host: str) -> Dict[str, Optional[str]]:
+    """Cookies a response and the redirects before it changed in the jar, None for deletions.
+
+    Only responses from the session's host or its subdomains count, a
+    third-party Set-Cookie must not end up in the jar. Of those, only
+    cookies already in the jar or allowed by the host's capture rule are
+    kept, and a Domain attribute has to cover the session's host.
+    """
+    key = session_key(host)
+    hostname = (urlsplit("//" + host).hostname or host).lower()
+    rule = capture_rules.match(hostname)
+    allowed = rule.cookies if rule is not None else frozenset()
+    changes = {}
+    for hop in (*response.history, response):
+        hop_key = session_key(hop.url.host)
+        if hop_key != key and not hop_key.endswith("_" + key):
+            continue
+        for header in hop.headers.get_list("set-cookie"):
+            parsed = parse_set_cookie(header)
+            if parsed is None:
+                continue
+            name, value, domain = parsed
+            if name not in cookies and name.lower() not in allowed:
+                continue
+            if domain is not None and not domain_matches(hostname, domain):
+                continue
+            changes[name] = value
+    return {name: value for name, value in changes.items() if cookies.get(name) != value}
+
+
+class SessionRefresher:
+    """Writes rotated cookies back to the session store and hands out the newest jar.
+
+    current() checks the store at most every recheck_interval seconds per
+    host, so sessions embedded in tokens cost a dict lookup on most calls.
+    """
+
+    def __init__(self, store, recheck_interval: float = config.SESSION_RECHECK_INTERVAL):
+        self.store = store
+        self.recheck_interval = recheck_interval
+        # session key -> (checked at, newest stored session or None)
+        self.latest: Dict[str, Tuple[float, Optional[Dict]]] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.writebacks = 0
+
+    async def current(self, host: str, session: Dict) -> Dict:
+        """The stored session for host if it is newer than session, else session"""
+        key = session_key(host)
+        now = time.monotonic()
+        checked = self.latest.get(key)
+        if checked is None or now - checked[0] >= self.recheck_interval:
+            # concurrent callers keep using the previous answer while one looks up
+            self.latest[key] = (now, checked[1] if checked else None)
+            checked = self.latest[key] = (now, await self.store.get_session(host))
+        latest = checked[1]
+        if latest is not None and latest.get("version", 0) > session.get("version", 0):
+            return latest
+        return session
+
+    async def write_back(self, host: str, session: Dict, response: httpx.Response) -> Dict:
+        """Merge the cookies a response rotated into the stored session, returns the jar to use next"""
+        changes = rotated_cookies(response, session["cookies"], host)
+        if not changes:
+            return session
+
+        key = session_key(host)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            updated = await self.store.merge_cookies(host, changes)
+        if updated is None:
+            return session
+
+        self.latest[key] = (time.monotonic(), updated)
+        self.writebacks += 1
+        metrics.SESSION_WRITEBACKS.inc(host=metrics.host_label(host))
+        # cookie names only, the values are credentials
+        log_event(logging.INFO, "session_refreshed",
+                  host=host, version=updated.get("version"), cookies=sorted(changes))
+        return updated
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import metrics
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls onto one in-flight call.
+
+    The first caller for a key starts the call, callers arriving while it
+    is still running await the same result instead of starting their own.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.calls.get(key)
+        if future is None:
+            self.leaders += 1
+            metrics.SINGLE_FLIGHT_LEADERS.inc()
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            # shield so one waiter giving up does not cancel the call for the others
+            return await asyncio.shield(future)
+
+        self.collapsed += 1
+        metrics.SINGLE_FLIGHT_COLLAPSED.inc()
+        # the call runs in the leader's task, a follower's wait is timed as its own stage
+        with metrics.stage("coalesced_wait"):
+            return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        if not future.cancelled():
+            # mark the exception retrieved even if every waiter went away
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "collapsed": self.collapsed
+        }
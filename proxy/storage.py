@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# key-value storage for the OAuth code store, values are JSON-serializable
+# dicts with an optional time-to-live
+#
+#   memory://                 in-process, the default, not shared between workers
+#   sqlite:///path/to/db      one WAL-mode file shared by every worker on a machine
+#   redis://host:6379/0       any Redis-protocol server, needs the redis package
+
+
+class MemoryBackend:
+    """In-process backend, state is lost on restart and not shared between workers.
+
+    Keys with a TTL are also pushed on a heap ordered by expiry, so sweep()
+    drops everything that has expired in O(log n) per key without scanning
+    the live ones.
+    """
+
+    def __init__(self):
+        self.items: Dict[str, Tuple[Optional[float], Dict]] = {}
+        self.expiry_heap: List[Tuple[float, str]] = []
+
+    def _live(self, key: str) -> Optional[Dict]:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and time.time() >= expires_at:
+            del self.items[key]
+            return None
+        return value
+
+    async def put(self, key: str, value: Dict, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self.items[key] = (expires_at, value)
+        if expires_at is not None:
+            heapq.heappush(self.expiry_heap, (expires_at, key))
+
+    async def get(self, key: str) -> Optional[Dict]:
+        return self._live(key)
+
+    async def take(self, key: str) -> Optional[Dict]:
+        value = self._live(key)
+        self.items.pop(key, None)
+        return value
+
+    async def delete(self, key: str) -> None:
+        self.items.pop(key, None)
+
+    async def sweep(self) -> int:
+        """Drop expired keys, returning how many were removed"""
+        now = time.time()
+        removed = 0
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self.expiry_heap)
+            # skip heap entries for keys that were consumed or re-put since
+            item = self.items.get(key)
+            if item is not None and item[0] == expires_at:
+                del self.items[key]
+                removed += 1
+        return removed
+
+    async def count(self, prefix: str) -> int:
+        now = time.time()
+        return sum(1 for key, (expires_at, _) in self.items.items()
+                   if key.startswith(prefix) and (expires_at is None or expires_at > now))
+
+    async def close(self) -> None:
+        pass
+
+
+class SqliteBackend:
+    """SQLite backend in WAL mode, usable by several worker processes on one machine.
+
+    Calls run on worker threads, each with its own connection, so a busy
+    database never blocks the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+            self.local.conn = conn
+        return conn
+
+    def _put(self, key: str, value: Dict, ttl: Optional[float]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+    def _get(self, key: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _take(self, key: str) -> Optional[Dict]:
+        # a single DELETE ... RETURNING, so two workers can never both consume a key
+        row = self._connect().execute(
+            "DELETE FROM kv WHERE key = ? RETURNING value, expires_at",
+            (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _sweep(self) -> int:
+        return self._connect().execute(
+            "DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _count(self, prefix: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM kv WHERE key >= ? AND key < ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", time.time())).fetchone()[0]
+
+    async def put(self, key: str, value: Dict, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._put, key, value, ttl)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def take(self, key: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self._take, key)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def sweep(self) -> int:
+        return await asyncio.to_thread(self._sweep)
+
+    async def count(self, prefix: str) -> int:
+        return await asyncio.to_thread(self._count, prefix)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Redis-protocol backend for running the proxy across several machines"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "redis:// storage needs the redis package (pip install redis)")
+        self.client = redis.from_url(url)
+
+    async def put(self, key: str, value: Dict, ttl: Optional[float] = None) -> None:
+        await self.client.set(key, json.dumps(value),
+                              px=int(ttl * 1000) if ttl else None)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        value = await self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def take(self, key: str) -> Optional[Dict]:
+        # GETDEL is atomic on the server, expired keys are already gone
+        value = await self.client.getdel(key)
+        return json.loads(value) if value is not None else None
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+    async def sweep(self) -> int:
+        # the server expires keys itself
+        return 0
+
+    async def count(self, prefix: str) -> int:
+        return sum([1 async for _ in self.client.scan_iter(match=f"{prefix}*", count=1000)])
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def open_backend(url: str):
+    """Create the storage backend named by a memory://, sqlite:// or redis:// URL"""
+    scheme, _, rest = url.partition("://")
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme == "sqlite":
+        # sqlite:///abs/path.db or sqlite://relative/path.db
+        return SqliteBackend(rest)
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported storage URL: {url}")
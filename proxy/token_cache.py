@@ -0,0 +1,57 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import config
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of already-verified JWT claims, keyed by a token digest.
+
+    Entries are dropped once their exp claim has passed, so a cached token
+    is never accepted for longer than jwt.decode itself would accept it.
+    """
+
+    def __init__(self, max_size: int = config.TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict]:
+        key = self._key(token)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, claims = entry
+        if time.time() >= expires_at:
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: Dict) -> None:
+        # only tokens with an expiry are cached, anything else is re-verified
+        if "exp" not in claims or self.max_size <= 0:
+            return
+        key = self._key(token)
+        self.entries[key] = (claims["exp"], claims)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def cache_info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "max_size": self.max_size
+        }
@@ -0,0 +1,128 @@
+import asyncio
+from collections import OrderedDict
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, Set
+from urllib.parse import urlparse
+
+import httpx
+
+import config
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# --- Upstream Connection Pool ---
+
+
+class UpstreamPool:
+    """App-lifetime pool of keep-alive connections to upstream hosts.
+
+    Each upstream host gets its own httpx client so keep-alive limits apply
+    per host and one busy host cannot starve the connections of another.
+    Clients are kept for the max_hosts most recently used hosts; an evicted
+    client is closed once the requests still running on it have finished.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = config.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = config.UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry: float = config.UPSTREAM_KEEPALIVE_EXPIRY,
+        connect_timeout: float = config.UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout: float = config.UPSTREAM_READ_TIMEOUT,
+        pool_timeout: float = config.UPSTREAM_POOL_TIMEOUT,
+        http2: bool = config.UPSTREAM_HTTP2,
+        max_hosts: int = config.UPSTREAM_MAX_HOSTS
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            read_timeout,
+            connect=connect_timeout,
+            pool=pool_timeout
+        )
+        # h2 is optional, fall back to HTTP/1.1 keep-alive without it
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.max_hosts = max_hosts
+        self.clients: OrderedDict = OrderedDict()
+        self.retiring: Set[asyncio.Task] = set()
+        self.started = False
+
+    async def start(self) -> None:
+        self.started = True
+
+    async def close(self) -> None:
+        clients = list(self.clients.values())
+        self.clients.clear()
+        self.started = False
+        for task in list(self.retiring):
+            task.cancel()
+        await asyncio.gather(*self.retiring, return_exceptions=True)
+        for client in clients:
+            await client.aclose()
+
+    async def _close_when_idle(self, client: httpx.AsyncClient) -> None:
+        try:
+            # responses still being read, streamed ones included, keep their connection
+            await asyncio.sleep(1.0)
+            while self._usage(client)["active"]:
+                await asyncio.sleep(1.0)
+        finally:
+            await client.aclose()
+
+    def _evict(self) -> None:
+        while len(self.clients) > self.max_hosts:
+            _, client = self.clients.popitem(last=False)
+            task = asyncio.get_running_loop().create_task(self._close_when_idle(client))
+            self.retiring.add(task)
+            task.add_done_callback(self.retiring.discard)
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        """Return the pooled client for the host of url, creating it on first use"""
+        if not self.started:
+            raise RuntimeError("Upstream pool is not started")
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc}"
+        client = self.clients.get(key)
+        if client is not None:
+            self.clients.move_to_end(key)
+        else:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                # the client is shared by every session, so it must never
+                # remember Set-Cookie from one caller and replay it for another
+                cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+            )
+            self.clients[key] = client
+            self._evict()
+        return client
+
+    @staticmethod
+    def _usage(client: httpx.AsyncClient) -> Dict[str, int]:
+        # httpx does not expose its connection pool, read it off the transport
+        pool = getattr(client._transport, "_pool", None)
+        connections = getattr(pool, "connections", [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"active": len(connections) - idle, "idle": idle}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Active and idle connections held for each upstream host"""
+        return {key: self._usage(client) for key, client in self.clients.items()}
+
+
+def session_headers(session: Dict) -> Dict[str, str]:
+    """Build the upstream request headers for a stored session, cookies included"""
+    headers = dict(session["headers"])
+    if session["cookies"]:
+        headers["Cookie"] = "; ".join(
+            f"{name}={value}" for name, value in session["cookies"].items())
+    return headers